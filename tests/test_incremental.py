@@ -0,0 +1,29 @@
+import pickle
+
+import pandas as pd
+import pytest
+
+from incremental import load_state, save_state
+
+
+def test_state_round_trip(tmp_path):
+    state = {'digest': [{'month': pd.Period('2021-03', 'M'), 'nodes': 3}]}
+    save_state(tmp_path / 'state.pkl', state)
+    assert load_state(tmp_path / 'state.pkl') == state
+
+
+@pytest.mark.parametrize('content', [
+    b'',
+    b'not a pickle',
+    pickle.dumps({'a': 1})[:-3],
+    # classes that do not exist in this environment, as in pickles of other pandas versions
+    b'cno_such_module\nState\n)R.',
+    b'cpandas\nNoSuchClass\n)R.',
+])
+def test_unreadable_state_is_empty(tmp_path, content):
+    (tmp_path / 'state.pkl').write_bytes(content)
+    assert load_state(tmp_path / 'state.pkl') == {}
+
+
+def test_missing_state_is_empty(tmp_path):
+    assert load_state(tmp_path / 'state.pkl') == {}
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from merge_te import merge_tables
+from te_io import read_te, write_te
+
+
+def te_table(n):
+    """Transmission-event table of n pairs, as written by snps2te.py."""
+    return pd.DataFrame({
+        'sample1': [f'S{i}' for i in range(n)],
+        'sample2': [f'S{i + 1}' for i in range(n)],
+        'transmission': [i % 2 for i in range(n)],
+        'snps': list(range(n)),
+        'expected_snps': [1.5 * i for i in range(n)],
+        'CI': [f'{1.425 * i}-{1.575 * i}' for i in range(n)],
+        'date_diff': [30 * i for i in range(n)],
+        'transmission_10SNP': [1] * n,
+    })
+
+
+def test_header_only_tsv_merges_with_parquet(tmp_path):
+    # a cluster whose pairs were all filtered out leaves a header-only table
+    write_te(te_table(0), tmp_path / 'empty_te.tsv')
+    write_te(te_table(5), tmp_path / 'full_te.parquet')
+    inputs = [tmp_path / 'empty_te.tsv', tmp_path / 'full_te.parquet']
+
+    merge_tables(inputs, tmp_path / 'merged.parquet')
+    merge_tables(inputs, tmp_path / 'merged.tsv')
+
+    expected = read_te(tmp_path / 'full_te.parquet')
+    for output in ('merged.parquet', 'merged.tsv'):
+        merged = read_te(tmp_path / output, columns=['sample1', 'snps', 'date_diff', 'transmission_10SNP'])
+        assert merged['sample1'].astype(str).tolist() == expected['sample1'].astype(str).tolist()
+        assert merged['snps'].tolist() == expected['snps'].tolist()
+        assert merged['date_diff'].tolist() == expected['date_diff'].tolist()
+        assert merged['transmission_10SNP'].tolist() == [1] * 5
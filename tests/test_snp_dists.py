@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from snp_dists import (ENCODING, drop_constant_sites, incremental_distances, pack_bases, pairwise_distances,
+                       read_alignment)
+
+
+def random_alignment(n, length, seed):
+    """n random sequences with lowercase bases, N, gaps, ambiguity codes and some constant sites."""
+    rng = np.random.default_rng(seed)
+    seqs = rng.choice(list('ACGTACGTACGTacgtN-RY'), size=(n, length))
+    seqs[:, ::7] = 'A'
+    seqs[:, 3::11] = rng.choice(list('Ca-N'), size=(n, len(range(3, length, 11))))
+    return [''.join(s) for s in seqs]
+
+
+def write_fasta(path, seqs):
+    with open(path, 'w') as f:
+        for k, s in enumerate(seqs):
+            # wrapped over several lines, as in ska align output
+            f.write(f'>seq{k} description\n' + '\n'.join(s[p:p + 60] for p in range(0, len(s), 60)) + '\n')
+
+
+def naive_distances(seqs):
+    """{(i, j): snps} for i<j, counting sites where both bases are A/C/G/T (any case) and differ."""
+    upper = [s.upper() for s in seqs]
+    return {(i, j): sum(a != b and a in 'ACGT' and b in 'ACGT' for a, b in zip(upper[i], upper[j]))
+            for i in range(len(seqs)) for j in range(i + 1, len(seqs))}
+
+
+def collect(distances):
+    """Flattens (i, j, snps) strips into a list of (i, j, snps) tuples, in output order."""
+    return [(int(i), int(j), int(d)) for strip in distances for i, j, d in zip(*strip)]
+
+
+@pytest.fixture(scope='module')
+def alignment(tmp_path_factory):
+    seqs = random_alignment(23, 250, 0)
+    path = tmp_path_factory.mktemp('aln') / 'aln.fa'
+    write_fasta(path, seqs)
+    return seqs, read_alignment(path)
+
+
+def test_read_alignment(alignment):
+    seqs, (names, matrix) = alignment
+    assert names == [f'seq{k}' for k in range(len(seqs))]
+    assert matrix.shape == (len(seqs), len(seqs[0]))
+
+
+@pytest.mark.parametrize('block_rows', [1, 2, 5, 22, 23, 100])
+def test_pairwise_distances_match_naive_count(alignment, block_rows):
+    seqs, (_, matrix) = alignment
+    result = collect(pairwise_distances(pack_bases(drop_constant_sites(matrix)), block_rows))
+    expected = naive_distances(seqs)
+    # every i<j pair once, ordered by i then j
+    assert [(i, j) for i, j, _ in result] == sorted(expected)
+    assert {(i, j): d for i, j, d in result} == expected
+
+
+def test_constant_sites_do_not_change_distances(alignment):
+    _, (_, matrix) = alignment
+    dropped = drop_constant_sites(matrix)
+    assert dropped.shape[1] < matrix.shape[1]
+    assert collect(pairwise_distances(pack_bases(dropped), 4)) == collect(pairwise_distances(pack_bases(matrix), 4))
+
+
+def test_no_variable_sites():
+    seqs = ['ACGTN', 'ACGT-', 'acgtA']
+    matrix = drop_constant_sites(ENCODING[np.array([list(s.encode()) for s in seqs], dtype=np.uint8)])
+    assert matrix.shape[1] == 0
+    assert {(i, j): d for i, j, d in collect(pairwise_distances(pack_bases(matrix), 2))} == naive_distances(seqs)
+
+
+@pytest.mark.parametrize('threads', [2, 3, 8])
+@pytest.mark.parametrize('block_rows', [1, 3, 10])
+def test_threads_match_one_thread(alignment, threads, block_rows):
+    _, (_, matrix) = alignment
+    packed = pack_bases(drop_constant_sites(matrix))
+    assert collect(pairwise_distances(packed, block_rows, threads)) == collect(pairwise_distances(packed, block_rows))
+
+
+@pytest.mark.parametrize('new', [[0], [22], [3, 7, 8, 20], list(range(0, 23, 2)), list(range(23))])
+@pytest.mark.parametrize('block_rows, threads', [(1, 1), (3, 1), (4, 3), (50, 2)])
+def test_incremental_matches_full_recomputation(alignment, new, block_rows, threads):
+    seqs, (_, matrix) = alignment
+    packed = pack_bases(drop_constant_sites(matrix))
+    result = collect(incremental_distances(packed, np.array(new), block_rows, threads))
+    expected = {pair: d for pair, d in naive_distances(seqs).items() if set(pair) & set(new)}
+    # every pair with a new row exactly once
+    assert len(result) == len(expected)
+    assert {(i, j): d for i, j, d in result} == expected
+    assert result == collect(incremental_distances(packed, np.array(new), block_rows))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from snps2te import prepare_data
+
+
+def old_prepare_data(s, m):
+    """prepare_data before pair canonicalization was vectorized: metadata merges, then a row-wise apply
+    building a sorted 'a-b' pair string and drop_duplicates on it."""
+    s.rename(columns={0: 'sample1', 1: 'sample2', 2: 'snps'}, inplace=True)
+
+    s = s.merge(m[['sampleid', 'samplingdate']], left_on='sample1', right_on='sampleid', how='left')
+    s.rename(columns={'samplingdate': 'date1'}, inplace=True)
+    s = s.merge(m[['sampleid', 'samplingdate']], left_on='sample2', right_on='sampleid', how='left', suffixes=('', '_sample2'))
+    s.rename(columns={'samplingdate': 'date2'}, inplace=True)
+
+    s['date1'] = pd.to_datetime(s['date1'], format='%Y-%m-%d', errors='coerce')
+    s['date2'] = pd.to_datetime(s['date2'], format='%Y-%m-%d', errors='coerce')
+    s = s[s['date1'].notna() & s['date2'].notna()]
+    s['date_diff'] = (s['date2'] - s['date1']).dt.days.abs()
+
+    if 'pat_id' in m.columns:
+        s = s.merge(m[['sampleid', 'pat_id']], left_on='sample1', right_on='sampleid', how='left')
+        s.rename(columns={'pat_id': 'pat_id1'}, inplace=True)
+        s = s.merge(m[['sampleid', 'pat_id']], left_on='sample2', right_on='sampleid', how='left', suffixes=('', '_sample2'))
+        s.rename(columns={'pat_id': 'pat_id2'}, inplace=True)
+        s = s[~((s['pat_id1'].notna()) & (s['pat_id2'].notna()) & (s['pat_id1'] == s['pat_id2']))]
+
+    s = s[s['sample1'] != s['sample2']]
+    s.reset_index(drop=True, inplace=True)
+
+    s['pair'] = s.apply(lambda row: '-'.join(sorted([str(row['sample1']), str(row['sample2'])])), axis=1)
+    s = s.drop_duplicates(subset=['pair']).drop(columns=['pair'])
+
+    return s
+
+
+def snp_dists_m(n_samples, rng):
+    """Synthetic snp-dists -m output: every ordered pair including self-pairs, mirrored pairs with the same
+    distance, rows shuffled."""
+    names = [f'S{i:03d}' for i in range(n_samples)]
+    snps = np.triu(rng.integers(0, 200, (n_samples, n_samples)), 1)
+    snps = snps + snps.T
+    i, j = np.meshgrid(np.arange(n_samples), np.arange(n_samples), indexing='ij')
+    s = pd.DataFrame({0: np.array(names)[i.ravel()], 1: np.array(names)[j.ravel()], 2: snps.ravel()})
+    return s.sample(frac=1, random_state=int(rng.integers(1 << 31))).reset_index(drop=True), names
+
+
+def metadata(names, rng, pat_ids=True):
+    """Sampling dates over two years, a few without date, and shared patient IDs."""
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 730, len(names)), 'D')
+    m = pd.DataFrame({'sampleid': names, 'samplingdate': dates.strftime('%Y-%m-%d')})
+    m.loc[rng.random(len(names)) < 0.05, 'samplingdate'] = np.nan
+    if pat_ids:
+        m['pat_id'] = [f'P{p}' if p < 15 else np.nan for p in rng.integers(0, 20, len(names))]
+    return m
+
+
+@pytest.mark.parametrize('pat_ids', [True, False])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_prepare_data_matches_old_path(seed, pat_ids):
+    rng = np.random.default_rng(seed)
+    s, names = snp_dists_m(40, rng)
+    m = metadata(names, rng, pat_ids)
+
+    old = old_prepare_data(s.copy(), m)
+    new = prepare_data(s.copy(), m)
+
+    columns = ['sample1', 'sample2', 'snps', 'date_diff']
+    pd.testing.assert_frame_equal(new[columns].reset_index(drop=True), old[columns].reset_index(drop=True),
+                                  check_dtype=False)
+    # same dates, whatever the datetime resolution
+    for c in ('date1', 'date2'):
+        assert (new[c].to_numpy(dtype='datetime64[D]') == old[c].to_numpy(dtype='datetime64[D]')).all()
@@ -0,0 +1,53 @@
+import networkx as nx
+import pytest
+
+from te_network import CENTRALITIES, component_parameters, networkx_centralities, sparse_centralities
+
+
+def random_connected(n, p, seed):
+    """Largest connected component of a G(n, p) random graph, relabelled 0..n-1."""
+    G = nx.gnp_random_graph(n, p, seed=seed)
+    return nx.convert_node_labels_to_integers(G.subgraph(max(nx.connected_components(G), key=len)))
+
+
+GRAPHS = {
+    'random_sparse': random_connected(120, 0.03, 0),
+    'random_dense': random_connected(60, 0.2, 1),
+    'random_tree': nx.random_labeled_tree(150, seed=2),
+    'path': nx.path_graph(200),
+    'star': nx.star_graph(80),
+    'barbell': nx.barbell_graph(15, 10),
+    'cycle': nx.cycle_graph(31),
+}
+
+
+@pytest.mark.parametrize('name', GRAPHS)
+def test_sparse_matches_networkx(name):
+    G = GRAPHS[name]
+    expected = networkx_centralities(G)
+    result = sparse_centralities(G)
+    assert set(result) == set(CENTRALITIES)
+    for measure in CENTRALITIES:
+        assert result[measure] == pytest.approx(expected[measure], rel=1e-9, abs=1e-12), measure
+
+
+@pytest.mark.parametrize('n', [1, 2])
+def test_sparse_skips_components_networkx_cannot_compute(n):
+    G = nx.path_graph(n)
+    assert networkx_centralities(G) is None
+    assert sparse_centralities(G) is None
+
+
+def test_sparse_matches_networkx_in_small_batches(monkeypatch):
+    monkeypatch.setattr('te_network.SPARSE_BLOCK', 500)
+    G = GRAPHS['barbell']
+    expected = networkx_centralities(G)
+    result = sparse_centralities(G)
+    for measure in CENTRALITIES:
+        assert result[measure] == pytest.approx(expected[measure], rel=1e-9, abs=1e-12), measure
+
+
+@pytest.mark.parametrize('approx, pivots', [(0, None), (5, 0)])
+def test_approx_samples_at_least_one_pivot(approx, pivots):
+    result, estimated = component_parameters(nx.path_graph(10), 0, approx=approx, pivots=pivots)
+    assert estimated and set(result) == set(CENTRALITIES)
@@ -0,0 +1,89 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+
+from te_windows import WINDOW_COLUMNS, window_parameters
+
+
+def rebuilt_parameters(te, edge_column, window, step):
+    """window_parameters from a networkx graph built from scratch for every window."""
+    te = te[te['samplingdate1'].notna()]
+    rows = []
+    if len(te):
+        start = te['samplingdate1'].min().normalize()
+        while start <= te['samplingdate1'].max():
+            end = start + window
+            events = te[(te['samplingdate1'] >= start) & (te['samplingdate1'] < end)]
+            G = nx.Graph()
+            G.add_nodes_from(events['sample1'])
+            G.add_nodes_from(events['sample2'])
+            linked = events[(events[edge_column] == 1) & (events['sample1'] != events['sample2'])]
+            G.add_edges_from(zip(linked['sample1'], linked['sample2']))
+            n, m = len(G), G.number_of_edges()
+            components = list(nx.connected_components(G))
+            rows.append([start, end, n, m, len(components), max(map(len, components), default=0),
+                         2 * m / n if n else 0.0, max((d for _, d in G.degree), default=0),
+                         2 * m / (n * (n - 1)) if n > 1 else 0.0])
+            start += step
+    return pd.DataFrame(rows, columns=WINDOW_COLUMNS)
+
+
+def random_events(n_events, n_samples, days, seed):
+    """Events between random samples on random days, about two thirds of them transmissions."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'sample1': [f'S{i}' for i in rng.integers(n_samples, size=n_events)],
+        'sample2': [f'S{i}' for i in rng.integers(n_samples, size=n_events)],
+        'samplingdate1': pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(days, size=n_events), unit='D'),
+        'te_10_60d': (rng.random(n_events) < 2 / 3).astype(int),
+    })
+
+
+def bridge_events():
+    """Two triangles joined by a bridge event that leaves the window first, splitting the component."""
+    events = [('a', 'b', 0), ('b', 'c', 5), ('c', 'a', 5), ('c', 'd', 1), ('d', 'e', 5), ('e', 'f', 5),
+              ('f', 'd', 5), ('a', 'b', 9), ('e', 'f', 12), ('c', 'd', 15)]
+    return pd.DataFrame({
+        'sample1': [u for u, _, _ in events],
+        'sample2': [v for _, v, _ in events],
+        'samplingdate1': pd.Timestamp('2021-01-01') + pd.to_timedelta([day for _, _, day in events], unit='D'),
+        'te_10_60d': 1,
+    })
+
+
+TABLES = {
+    'sparse': random_events(300, 120, 200, 0),
+    'dense': random_events(400, 25, 100, 1),
+    'repeated_pairs': random_events(300, 8, 60, 2),
+    'bridge': bridge_events(),
+}
+
+
+@pytest.mark.parametrize('name', TABLES)
+@pytest.mark.parametrize('window, step', [(7, 1), (30, 7), (10, 20)])
+def test_windows_match_networkx_rebuild(name, window, step):
+    te = TABLES[name]
+    window, step = pd.Timedelta(days=window), pd.Timedelta(days=step)
+    result = window_parameters(te, 'te_10_60d', window, step)
+    expected = rebuilt_parameters(te, 'te_10_60d', window, step)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_bridge_leaving_splits_component():
+    result = window_parameters(bridge_events(), 'te_10_60d', pd.Timedelta(days=6), pd.Timedelta(days=1))
+    # day 0-5: both triangles joined by c-d; day 2-7: the bridge has left
+    assert result.loc[0, ['components', 'largest_component']].tolist() == [1, 6]
+    assert result.loc[2, ['components', 'largest_component']].tolist() == [2, 3]
+
+
+def test_empty_table():
+    te = random_events(0, 1, 1, 0)
+    result = window_parameters(te, 'te_10_60d', pd.Timedelta(days=7), pd.Timedelta(days=1))
+    assert result.empty and list(result.columns) == WINDOW_COLUMNS
+
+
+@pytest.mark.parametrize('window, step', [(7, 0), (7, -1), (0, 1), (-7, 1)])
+def test_non_positive_window_or_step(window, step):
+    with pytest.raises(ValueError):
+        window_parameters(bridge_events(), 'te_10_60d', pd.Timedelta(days=window), pd.Timedelta(days=step))
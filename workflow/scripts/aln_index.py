@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+'''Index an alignment once: number of taxa, alignment length and variable sites'''
+
+import argparse
+import json
+
+from snp_dists import read_alignment, variable_sites
+
+
+def get_options():
+    """Parses command line arguments."""
+    description = 'Write a small JSON index of a FASTA alignment, read by later rules instead of the alignment.'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('alignment', help='FASTA alignment (e.g. ska align output)')
+    parser.add_argument('output', help='Output JSON file: taxa, length, variable_sites')
+
+    return parser.parse_args()
+
+
+def index_alignment(alignment_path):
+    """Number of taxa, alignment length and number of variable A/C/G/T sites of an alignment."""
+    names, matrix = read_alignment(alignment_path)
+    return {
+        'taxa': len(names),
+        'length': int(matrix.shape[1]),
+        'variable_sites': int(variable_sites(matrix).sum()),
+    }
+
+
+def main():
+    options = get_options()
+
+    with open(options.output, 'w') as out:
+        json.dump(index_alignment(options.alignment), out)
+
+
+if __name__ == "__main__":
+    main()
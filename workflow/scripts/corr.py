@@ -15,6 +15,8 @@ sns.set_context('talk')
 from scipy.stats import spearmanr
 from statsmodels.stats.multitest import fdrcorrection
 
+from metadata_cache import load_metadata
+
 def get_options():
     import argparse
 
@@ -36,7 +38,7 @@ if __name__ == "__main__":
 
     # load data
     n = pd.read_csv(options.net, sep="\t")
-    m = pd.read_csv(options.data, sep="\t")
+    m = load_metadata(options.data)
     r = pd.read_csv(options.restrictions, sep="\t")
 
     # get mean values by month
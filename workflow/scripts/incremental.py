@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+'''Snapshots of previous outputs, reused by incremental runs'''
+
+import os
+import pickle
+import shutil
+
+
+def snapshot_path(path):
+    """Snapshot kept next to an output file: name.ext -> name.prev.ext."""
+    root, ext = os.path.splitext(str(path))
+    return f"{root}.prev{ext}"
+
+
+def previous_output(path):
+    """Snapshot of the last successful output, or None on a first run.
+
+    Snakemake removes outputs before rerunning a job, so the previous results are read from the snapshot.
+    """
+    snapshot = snapshot_path(path)
+    return snapshot if os.path.exists(snapshot) else None
+
+
+def save_snapshot(path):
+    """Points the snapshot at a finished output. A hard link when possible, so no extra space is used."""
+    snapshot = snapshot_path(path)
+    if os.path.exists(snapshot) and os.path.samefile(path, snapshot):
+        return
+    tmp = f"{snapshot}.{os.getpid()}.tmp"
+    try:
+        os.link(path, tmp)
+    except OSError:
+        shutil.copy2(path, tmp)
+    os.replace(tmp, snapshot)
+
+
+def release_output(path):
+    """Removes an existing output before it is rewritten, as it may share its data with the snapshot."""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def load_state(path):
+    """State pickled by a previous run (e.g. per-month results), or an empty dict.
+
+    Any failure to load it (missing, partial, pickled under other pandas or numpy versions) gives an empty
+    state, so everything is computed again.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return {}
+
+
+def save_state(path, state):
+    """Pickles the state of this run atomically."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
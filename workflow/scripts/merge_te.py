@@ -3,6 +3,10 @@
 import argparse
 from pathlib import Path
 
+import pyarrow.parquet as pq
+
+from te_io import add_ci_string, compact_table, expand_table, read_te, te_format
+
 def merge_files(input_files, output_file):
     """Merges multiple input files into a single output file."""
     with output_file.open('w') as outfile:
@@ -11,13 +15,37 @@ def merge_files(input_files, output_file):
             header = first_file.readline()
             outfile.write(header)
 
-        # Write content from all files, skipping headers for subsequent files
+        # Write content from all files, skipping their headers
         for file_path in input_files:
             with file_path.open('r') as infile:
-                if file_path != input_files[0]:  # Skip header in subsequent files
-                    infile.readline()
+                infile.readline()
                 outfile.writelines(infile)
 
+def read_table(input_file):
+    """Reads a TSV or Parquet input file as a compact Arrow table."""
+    if te_format(input_file) == 'parquet':
+        return pq.read_table(input_file)
+    return compact_table(read_te(input_file))
+
+def merge_tables(input_files, output_file):
+    """Merges TSV and/or Parquet input files one at a time into a TSV or Parquet output file."""
+    writer = None
+    for i, file_path in enumerate(input_files):
+        table = read_table(file_path)
+
+        if te_format(output_file) == 'parquet':
+            if writer is None:
+                writer = pq.ParquetWriter(output_file, table.schema, compression='zstd')
+            elif table.schema.metadata != writer.schema.metadata:
+                raise ValueError(f"Transmission columns in {file_path} do not match {input_files[0]}.")
+            writer.write_table(table.cast(writer.schema))
+        else:
+            add_ci_string(expand_table(table)).to_csv(output_file, index=False, sep='\t',
+                                                      header=i == 0, mode='w' if i == 0 else 'a')
+
+    if writer is not None:
+        writer.close()
+
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Merge TE files")
@@ -32,8 +60,11 @@ def main():
     if not input_files:
         raise ValueError("No input files provided.")
 
-    # Merge files
-    merge_files(input_files, output_file)
+    # Merge files, as plain text when everything is TSV
+    if all(te_format(f) == 'tsv' for f in input_files + [output_file]):
+        merge_files(input_files, output_file)
+    else:
+        merge_tables(input_files, output_file)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+'''Parsed metadata cache shared by the pipeline scripts'''
+
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# schema metadata key holding the size, mtime and hash of the source file
+SOURCE_KEY = b'tenet_metadata_source'
+
+
+def file_hash(path):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(path):
+    """Cache file kept next to the metadata file."""
+    return f"{path}.cache.parquet"
+
+
+def read_cache(path, stat):
+    """Returns the cached metadata table for path if it still matches the source file, else None.
+
+    The cache is Parquet, readable whatever the pandas version. Any failure to read it (missing, partial,
+    written by another environment, unexpected content) is a miss, and the metadata is parsed again.
+    """
+    try:
+        table = pq.read_table(cache_path(path))
+        source = json.loads(table.schema.metadata[SOURCE_KEY])
+        if (source['mtime_ns'], source['size']) == (stat.st_mtime_ns, stat.st_size):
+            return table.to_pandas()
+        # touched but possibly unchanged: compare content before reparsing
+        if source['size'] == stat.st_size and source['sha256'] == file_hash(path):
+            m = table.to_pandas()
+            write_cache(path, m, dict(source, mtime_ns=stat.st_mtime_ns))
+            return m
+    except Exception:
+        pass
+    return None
+
+
+def write_cache(path, m, source):
+    """Writes the cache atomically, so parallel jobs never read a partial file.
+
+    Skipped if not writable, or if the table cannot be stored as Parquet (e.g. mixed-type columns).
+    """
+    tmp = f"{cache_path(path)}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(m, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SOURCE_KEY] = json.dumps(source).encode()
+        pq.write_table(table.replace_schema_metadata(metadata), tmp)
+        os.replace(tmp, cache_path(path))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_entry(path):
+    """Loads the metadata TSV, from the cache if still valid, else parsing it and refreshing the cache."""
+    stat = os.stat(path)
+    m = read_cache(path, stat)
+    if m is None:
+        m = pd.read_csv(path, sep="\t")
+        write_cache(path, m, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_hash(path)})
+    return {
+        'metadata': m,
+        'by_sample': m.drop_duplicates(subset='sampleid').set_index('sampleid'),
+    }
+
+
+def load_metadata(path):
+    """Metadata table as read with pd.read_csv(path, sep='\\t'), served from the cache when valid."""
+    return load_entry(path)['metadata']
+
+
+def load_sample_index(path):
+    """Metadata indexed by sampleid, first row of each duplicated sampleid, served from the cache when valid."""
+    return load_entry(path)['by_sample']
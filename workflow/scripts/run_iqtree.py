@@ -1,38 +1,130 @@
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import time
 from pathlib import Path
 
-def run_iqtree(alignment_file, output_tree, model, prefix, threads):
-    command = f"iqtree --quiet -st DNA -s {alignment_file} -T {threads} --prefix {prefix} -m {model}"
-    exit_code = os.system(command)
-    return exit_code
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def main(alignment_file, output_tree, model, alternative_model, prefix, threads):
-    with open(alignment_file) as aln:
-        sequences = sum(1 for line in aln if line.startswith(">"))
+def read_cache(cache_file):
+    # {alignment sha256: {model: last run}} from previous runs of this cluster
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    if sequences < 3:
+def write_cache(cache_file, cache):
+    tmp = f"{cache_file}.tmp"
+    Path(tmp).write_text(json.dumps(cache, indent=2) + "\n")
+    os.replace(tmp, cache_file)
+
+def run_iqtree(alignment_file, model, prefix, threads, resume=False):
+    # -redo overwrites the files of earlier runs, unless resuming an interrupted run from its checkpoint
+    command = ["iqtree", "--quiet", "-st", "DNA", "-s", alignment_file, "-T", str(threads), "--prefix", prefix,
+               "-m", model]
+    if not resume:
+        command.append("-redo")
+    start = time.time()
+    try:
+        exit_code = subprocess.run(command).returncode
+    except OSError as e:
+        print(f"Could not run IQ-TREE: {e}")
+        exit_code = 127
+    return {"model": model, "exit_code": exit_code, "seconds": round(time.time() - start, 3), "resumed": resume}
+
+def model_failed(prefix, exit_code):
+    # only IQ-TREE rejecting the model itself (+ASC on an alignment with invariant sites) is worth caching:
+    # 127 means IQ-TREE could not be started, negative codes a kill by a signal (e.g. out of memory)
+    if exit_code <= 0 or exit_code == 127:
+        return False
+    try:
+        log = Path(f"{prefix}.log").read_text(errors="replace")
+    except OSError:
+        return False
+    return "ASC" in log and "invariant sites" in log
+
+def run_cached(alignment_file, model, prefix, threads, cache_file, cache, alignment_hash):
+    # runs one model, recording it in the cache keyed by alignment content and model
+    runs = cache.setdefault(alignment_hash, {})
+    # a run still marked as running was interrupted: continue from its checkpoint
+    resume = runs.get(model, {}).get("status") == "running" and os.path.exists(f"{prefix}.ckp.gz")
+    runs[model] = {"status": "running"}
+    write_cache(cache_file, cache)
+
+    run = run_iqtree(alignment_file, model, prefix, threads, resume)
+    if run["exit_code"] == 0:
+        runs[model] = dict(run, status="ok")
+    elif model_failed(prefix, run["exit_code"]):
+        runs[model] = dict(run, status="failed")
+    else:
+        # any other error may not happen again, the model is tried on the next run
+        del runs[model]
+        if not runs:
+            del cache[alignment_hash]
+    write_cache(cache_file, cache)
+    return run
+
+def write_status(done_file, status):
+    # structured record of the tree step: status, alignment index and one entry per IQ-TREE run
+    Path(done_file).write_text(json.dumps(status, indent=2) + "\n")
+
+def main(alignment_file, index_file, output_tree, done_file, model, alternative_model, prefix, threads):
+    # results of earlier runs on this cluster, kept next to the IQ-TREE outputs
+    cache_file = f"{prefix}.models.json"
+    # taxa and variable sites come from the alignment index, the alignment itself is not read
+    with open(index_file) as index:
+        alignment = json.load(index)
+    status = {"alignment": alignment, "threads": threads, "runs": []}
+
+    if alignment["taxa"] < 3 or alignment["variable_sites"] == 0:
+        reason = "fewer than 3 sequences" if alignment["taxa"] < 3 else "no variable sites"
         Path(output_tree).write_text("")
-        print(f"Skipped tree construction for {output_tree} due to insufficient sequences.")
+        print(f"Skipped tree construction for {output_tree} due to {reason}.")
+        write_status(done_file, dict(status, status="skipped", reason=reason))
+        return
+
+    cache = read_cache(cache_file)
+    alignment_hash = file_hash(alignment_file)
+    status["alignment"]["sha256"] = alignment_hash
+
+    # the primary model is not tried again on an alignment it already failed on
+    if cache.get(alignment_hash, {}).get(model, {}).get("status") == "failed":
+        print(f"Model {model} already failed on this alignment, skipping it for {output_tree}")
+        status["runs"].append({"model": model, "exit_code": cache[alignment_hash][model]["exit_code"],
+                               "cached": True})
     else:
         print(f"Running IQ-TREE with model {model} for {output_tree}")
-        exit_code = run_iqtree(alignment_file, output_tree, model, prefix, threads)
-        
-        if exit_code != 0:
-            print(f"Initial model failed. Trying alternative model {alternative_model} for {output_tree}")
-            exit_code = run_iqtree(alignment_file, output_tree, alternative_model, prefix, threads)
-
-            if exit_code != 0:
-                sys.exit(f"IQ-TREE failed with both {model} and {alternative_model} models.")
-            else:
-                print(f"Tree construction succeeded with alternative model {alternative_model}.")
+        status["runs"].append(run_cached(alignment_file, model, prefix, threads, cache_file, cache,
+                                         alignment_hash))
+
+    if status["runs"][-1]["exit_code"] != 0:
+        print(f"Initial model failed. Trying alternative model {alternative_model} for {output_tree}")
+        status["runs"].append(run_cached(alignment_file, alternative_model, prefix, threads, cache_file, cache,
+                                         alignment_hash))
+
+        if status["runs"][-1]["exit_code"] != 0:
+            write_status(done_file, dict(status, status="failed"))
+            sys.exit(f"IQ-TREE failed with both {model} and {alternative_model} models.")
         else:
-            print(f"Tree construction succeeded with model {model}.")
+            print(f"Tree construction succeeded with alternative model {alternative_model}.")
+    else:
+        print(f"Tree construction succeeded with model {model}.")
+    write_status(done_file, dict(status, status="ok"))
 
 if __name__ == "__main__":
     main(
         snakemake.input.alignment,
+        snakemake.input.index,
         snakemake.output.tree,
+        snakemake.output.done,
         snakemake.params.model,
         snakemake.params.alternative_model,
         snakemake.params.prefix,
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from incremental import previous_output, release_output, save_snapshot
+
+
+# A/C/G/T (any case) map to 1-4, anything else (N, gaps, ambiguity codes) to 0 and is ignored,
+# as snp-dists does by default
+ENCODING = np.zeros(256, dtype=np.uint8)
+for i, base in enumerate('ACGT', start=1):
+    ENCODING[ord(base)] = i
+    ENCODING[ord(base.lower())] = i
+
+
+def get_options():
+    """Parses command line arguments."""
+    description = 'Pairwise SNP distances (i<j pairs only) from a FASTA alignment, in snp-dists molten format.'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('alignment', help='FASTA alignment (e.g. ska align output)')
+    parser.add_argument('output', help='Output TSV file: sample1, sample2, snps (no header)')
+    parser.add_argument('--block_bytes', help='Max bytes compared at once per thread, bounds memory usage', type=int, default=2**26)
+    parser.add_argument('--threads', help='Number of threads', type=int, default=1)
+    parser.add_argument('--incremental', help='Reuse the distances of the previous run (output snapshot) and only compute pairs with new samples', action='store_true')
+
+    return parser.parse_args()
+
+
+def read_alignment(alignment_path):
+    """Reads a FASTA alignment. Returns the sequence names and a uint8 matrix with one row per sequence."""
+    names, seqs = [], []
+    with open(alignment_path) as aln:
+        for line in aln:
+            line = line.strip()
+            if line.startswith('>'):
+                names.append(line[1:].split()[0])
+                seqs.append([])
+            elif line:
+                seqs[-1].append(line)
+
+    seqs = [''.join(s).encode() for s in seqs]
+    if not seqs:
+        return names, np.zeros((0, 0), dtype=np.uint8)
+    if len({len(s) for s in seqs}) > 1:
+        raise ValueError(f"Sequences in {alignment_path} are not all the same length.")
+
+    matrix = np.frombuffer(b''.join(seqs), dtype=np.uint8).reshape(len(seqs), -1)
+    return names, ENCODING[matrix]
+
+
+def variable_sites(matrix):
+    """Mask of the columns with more than one distinct base (missing bases ignored)."""
+    if len(matrix) == 0:
+        return np.zeros(matrix.shape[1], dtype=bool)
+    low = np.where(matrix == 0, 255, matrix).min(axis=0)
+    high = matrix.max(axis=0)
+    return high > low
+
+
+def drop_constant_sites(matrix):
+    """Removes columns with at most one distinct base, which cannot contribute to any distance."""
+    return matrix[:, variable_sites(matrix)]
+
+
+def pack_bases(matrix):
+    """Bit-packs an encoded alignment into one plane per base plus a plane of called (non-missing) sites."""
+    planes = [np.packbits(matrix == base, axis=1) for base in range(1, 5)]
+    return np.packbits(matrix != 0, axis=1), planes
+
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(x):
+        return POPCOUNT[x]
+
+
+def shared_bits(a, b):
+    """Number of set bits shared by every row of a and every row of b."""
+    return popcount(a[:, None, :] & b[None, :, :]).sum(axis=2, dtype=np.int64)
+
+
+def block_distances(packed, rows_a, rows_b):
+    """SNP counts between rows_a and rows_b: sites called in both minus sites with the same base."""
+    called, planes = packed
+    d = shared_bits(called[rows_a], called[rows_b])
+    for plane in planes:
+        d -= shared_bits(plane[rows_a], plane[rows_b])
+    return d
+
+
+def strip_distances(packed, i0, block_rows):
+    """(i, j, snps) arrays for rows i in [i0, i0 + block_rows) against all rows j > i, ordered by i then j."""
+    n = len(packed[0])
+    i1 = min(i0 + block_rows, n)
+    d = np.concatenate([block_distances(packed, slice(i0, i1), slice(j0, min(j0 + block_rows, n)))
+                        for j0 in range(i0, n, block_rows)], axis=1)
+
+    i, j = np.triu_indices(i1 - i0, k=1, m=n - i0)
+    return i + i0, j + i0, d[i, j]
+
+
+def new_pair_distances(packed, rows, is_new, block_rows):
+    """(i, j, snps) arrays with i<j for the given new rows against every old row and every later new row."""
+    n = len(packed[0])
+    d = np.concatenate([block_distances(packed, rows, slice(j0, min(j0 + block_rows, n)))
+                        for j0 in range(0, n, block_rows)], axis=1)
+
+    a, j = np.nonzero(~is_new[None, :] | (np.arange(n)[None, :] > rows[:, None]))
+    i = rows[a]
+    return np.minimum(i, j), np.maximum(i, j), d[a, j]
+
+
+def run_strips(strip, starts, threads=1):
+    """Yields strip(start) for each start, in order.
+
+    Strips are computed on a thread pool (numpy releases the GIL on the bitwise kernels), with at most
+    2 * threads strips in flight so memory stays bounded.
+    """
+    if threads <= 1:
+        for start in starts:
+            yield strip(start)
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for start in starts:
+            pending.append(executor.submit(strip, start))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def pairwise_distances(packed, block_rows, threads=1):
+    """Yields (i, j, snps) arrays for all i<j pairs, one strip of rows at a time, ordered by i then j."""
+    return run_strips(lambda i0: strip_distances(packed, i0, block_rows),
+                      range(0, len(packed[0]), block_rows), threads)
+
+
+def incremental_distances(packed, new, block_rows, threads=1):
+    """Yields (i, j, snps) arrays for the pairs involving at least one of the new rows, one strip at a time."""
+    is_new = np.zeros(len(packed[0]), dtype=bool)
+    is_new[new] = True
+    return run_strips(lambda s0: new_pair_distances(packed, new[s0:s0 + block_rows], is_new, block_rows),
+                      range(0, len(new), block_rows), threads)
+
+
+def read_previous(previous_file, names):
+    """Distances of a previous run between samples still in the alignment, and the rows of new samples.
+
+    Old pairs are reused as they are: new sequences can change which sites ska aligns, so they may differ
+    slightly from a full recomputation.
+    """
+    previous = pd.read_csv(previous_file, sep='\t', header=None, names=['sample1', 'sample2', 'snps'],
+                           dtype={'sample1': str, 'sample2': str})
+    old = pd.unique(previous[['sample1', 'sample2']].to_numpy().ravel())
+    current = pd.Index(names)
+    previous = previous[previous['sample1'].isin(current) & previous['sample2'].isin(current)]
+    return previous, np.flatnonzero(~current.isin(old))
+
+
+def save_distances(names, distances, output_file, previous=None):
+    """Writes pairwise distances as tab separated sample1, sample2, snps rows, after the reused previous rows."""
+    names = np.asarray(names, dtype=object)
+    with open(output_file, 'w') as out:
+        if previous is not None:
+            previous.to_csv(out, sep='\t', header=False, index=False)
+        for i, j, snps in distances:
+            pd.DataFrame({'sample1': names[i], 'sample2': names[j], 'snps': snps}).to_csv(
+                out, sep='\t', header=False, index=False)
+
+
+def main():
+    options = get_options()
+
+    names, matrix = read_alignment(options.alignment)
+    packed = pack_bases(drop_constant_sites(matrix))
+
+    # rows per block so that one block comparison stays within block_bytes
+    block_rows = max(1, int((options.block_bytes / max(packed[0].shape[1], 1)) ** 0.5))
+
+    previous_file = previous_output(options.output) if options.incremental else None
+    release_output(options.output)
+    if previous_file is None:
+        save_distances(names, pairwise_distances(packed, block_rows, options.threads), options.output)
+    else:
+        previous, new = read_previous(previous_file, names)
+        print(f"{len(new)} new samples, reusing {len(previous)} pairs from {previous_file}")
+        save_distances(names, incremental_distances(packed, new, block_rows, options.threads), options.output,
+                       previous)
+
+    if options.incremental:
+        save_snapshot(options.output)
+
+
+if __name__ == "__main__":
+    main()
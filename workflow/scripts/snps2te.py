@@ -5,6 +5,18 @@ import numpy as np
 from datetime import datetime
 import time
 import psutil
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+from incremental import previous_output, release_output, save_snapshot
+from metadata_cache import load_metadata
+from te_io import add_ci_bounds, add_ci_string, compact_table, read_te, te_format, write_te
+
+
+SNP_THRESHOLDS = [10, 20, 30, 100]
+DAYS_THRESHOLDS = [90, 180, 270, 365]
+TE_COLUMNS = ['sample1', 'sample2', 'transmission', 'snps', 'expected_snps', 'CI_lower', 'CI_upper', 'date_diff']
 
 
 def get_memory_usage():
@@ -16,12 +28,19 @@ def get_memory_usage():
 def get_options():
     """Parses command line arguments."""
     description = 'Parse SNP counts to transmission events from SNP-dists output dataframe. Default SNP threshold is 10.'
-    parser = argparse.ArgumentParser(description=description)
+    parser = argparse.ArgumentParser(description=description, fromfile_prefix_chars='@')
 
-    parser.add_argument('snp_dists', help='Output dataframe from snp-dists as TSV file')
+    parser.add_argument('snp_dists', help='Output dataframe(s) from snp-dists as TSV file, one _te file is written for each. @file reads arguments from a file, one per line', nargs='+')
     parser.add_argument('data', help='Metadata containing sampling date, and if available, patient ID')
     parser.add_argument('--snps', help='SNPs/day accumulation ratio', type=float, default=0.05)
     parser.add_argument('--min_snps', help='min number of SNPs considered a transmission independent of the time. Considering sequencing errors.', type=int, default=5)
+    parser.add_argument('--thresholds', help='SNP thresholds, one transmission_<t>SNP column each', type=int, nargs='+', default=SNP_THRESHOLDS)
+    parser.add_argument('--days_thresholds', help='Days thresholds, one transmission_<d>d column each', type=int, nargs='+', default=DAYS_THRESHOLDS)
+    parser.add_argument('--chunksize', help='Stream the snp-dists file in chunks of this many rows to bound memory usage', type=int, default=None)
+    parser.add_argument('--format', help='Output format: TSV, or compact Parquet (dictionary-encoded samples, packed flags)', choices=['tsv', 'parquet'], default='tsv')
+    parser.add_argument('--jobs', help='Number of snp-dists files processed in parallel', type=int, default=1)
+    parser.add_argument('--keep_all_pairs', help='Keep pairs that cannot be a transmission event under any threshold', action='store_true')
+    parser.add_argument('--incremental', help='Copy the pairs of the previous run (output snapshot) whose samples are still in the file and only classify new pairs. Options and metadata of old samples must be unchanged', action='store_true')
 
     return parser.parse_args()
 
@@ -29,50 +48,181 @@ def get_options():
 def load_data(snp_dists_path, metadata_path):
     """Loads SNP distances and metadata into pandas DataFrames."""
     s = pd.read_csv(snp_dists_path, delimiter="\t", header=None)
-    m = pd.read_csv(metadata_path, delimiter="\t")
+    m = load_metadata(metadata_path)
     return s, m
 
 
-def prepare_data(s, m):
-    """Merges metadata with SNP data and calculates date differences."""
-    s.rename(columns={0: 'sample1', 1: 'sample2', 2: 'snps'}, inplace=True)
+def prepare_data(s, m, snps_per_day=None, min_snps=None, thresholds=SNP_THRESHOLDS):
+    """Adds metadata to SNP data and calculates date differences.
 
-    # Merge metadata to add sampling dates
-    s = s.merge(m[['sampleid', 'samplingdate']], left_on='sample1', right_on='sampleid', how='left')
-    s.rename(columns={'samplingdate': 'date1'}, inplace=True)
-    s = s.merge(m[['sampleid', 'samplingdate']], left_on='sample2', right_on='sampleid', how='left', suffixes=('', '_sample2'))
-    s.rename(columns={'samplingdate': 'date2'}, inplace=True)
+    If snps_per_day and min_snps are given, pairs that can never be a transmission event are dropped first.
+    """
+    metadata = index_metadata(m)
+    cutoff = snp_cutoff(snps_per_day, min_snps, thresholds) if snps_per_day is not None else None
+    s, _, _ = prepare_chunk(s, metadata, cutoff=cutoff)
+    return s
 
-    # Ensure valid date parsing
-    s['date1'] = pd.to_datetime(s['date1'], format='%Y-%m-%d', errors='coerce')
-    s['date2'] = pd.to_datetime(s['date2'], format='%Y-%m-%d', errors='coerce')
+
+def prepare_chunk(s, metadata, samples=None, seen=None, cutoff=None, known=None):
+    """Prepares a chunk of SNP data against indexed metadata.
+
+    Sample codes and seen pairs carry over between chunks, so a pair is kept only on its first occurrence
+    in the whole file. Pairs in known (see sample_pairs) are dropped, they are already classified.
+    Returns the prepared chunk, the sample of each code and the seen-pairs bitset.
+    """
+    s = s.rename(columns={0: 'sample1', 1: 'sample2', 2: 'snps'})
+
+    # Drop self-comparisons and duplicates
+    s = s[s['sample1'] != s['sample2']]
+    if known is not None:
+        s = s[~sample_pairs(s).isin(known)]
+    s.reset_index(drop=True, inplace=True)
+
+    code1, code2, samples = encode_samples(s, samples)
+    first, seen = mark_seen(pair_keys(np.minimum(code1, code2), np.maximum(code1, code2)), seen)
+    s, code1, code2 = s[first], code1[first], code2[first]
+
+    # Look up sampling dates and patient IDs by sample code
+    dates, pat_ids = lookup_metadata(metadata, samples)
+    date1, date2 = np.take(dates, code1), np.take(dates, code2)
+    date_diff = np.abs((date2 - date1).astype(np.int64))
 
     # Filter rows with missing dates
-    s = s[s['date1'].notna() & s['date2'].notna()]
+    keep = ~np.isnat(date1) & ~np.isnat(date2)
 
-    # Calculate absolute date difference
-    s['date_diff'] = (s['date2'] - s['date1']).dt.days.abs()
+    # Drop pairs too distant to be a transmission event, before building any column
+    # (same expected SNPs and CI as calculate_transmission_events)
+    if cutoff is not None:
+        below, snps_per_day = cutoff
+        snps = s['snps'].to_numpy()
+        expected_snps = date_diff * snps_per_day
+        keep &= ((snps < below) | (snps <= expected_snps) |
+                 ((snps >= expected_snps * (1 - 0.05)) & (snps <= expected_snps * (1 + 0.05))))
 
     # Additional patient ID filtering (if applicable)
-    if 'pat_id' in m.columns:
-        s = s.merge(m[['sampleid', 'pat_id']], left_on='sample1', right_on='sampleid', how='left')
-        s.rename(columns={'pat_id': 'pat_id1'}, inplace=True)
-        s = s.merge(m[['sampleid', 'pat_id']], left_on='sample2', right_on='sampleid', how='left', suffixes=('', '_sample2'))
-        s.rename(columns={'pat_id': 'pat_id2'}, inplace=True)
+    if pat_ids is not None:
+        pat_id1, pat_id2 = np.take(pat_ids, code1), np.take(pat_ids, code2)
+        keep &= ~((pat_id1 >= 0) & (pat_id2 >= 0) & (pat_id1 == pat_id2))
 
-        s = s[~((s['pat_id1'].notna()) & (s['pat_id2'].notna()) & (s['pat_id1'] == s['pat_id2']))]
+    s = s[keep].copy()
+    s['date1'] = date1[keep]
+    s['date2'] = date2[keep]
 
-    # Drop self-comparisons and duplicates
-    s = s[s['sample1'] != s['sample2']]
-    s.reset_index(drop=True, inplace=True)
+    # Absolute date difference
+    s['date_diff'] = date_diff[keep]
 
-    s['pair'] = s.apply(lambda row: '-'.join(sorted([str(row['sample1']), str(row['sample2'])])), axis=1)
-    s = s.drop_duplicates(subset=['pair']).drop(columns=['pair'])
+    return s, samples, seen
 
-    return s
 
+def sample_pairs(s):
+    """Unordered sample pairs of a table, as a MultiIndex of (lower, higher) sample IDs."""
+    sample1 = s['sample1'].astype(str).to_numpy(dtype=object)
+    sample2 = s['sample2'].astype(str).to_numpy(dtype=object)
+    return pd.MultiIndex.from_arrays([np.minimum(sample1, sample2), np.maximum(sample1, sample2)])
+
+
+def dists_samples(s):
+    """Samples of a snp-dists table (first two columns), as strings."""
+    return pd.Index(pd.concat([s[0], s[1]], ignore_index=True).astype(str).unique())
+
+
+def file_samples(snp_dists_path, chunksize):
+    """Samples of a snp-dists file, reading only its first two columns chunksize rows at a time."""
+    samples = pd.Index([], dtype=object)
+    for chunk in pd.read_csv(snp_dists_path, delimiter="\t", header=None, usecols=[0, 1], chunksize=chunksize):
+        samples = samples.union(dists_samples(chunk))
+    return samples
+
+
+def keep_samples(previous, samples):
+    """Rows of a previous table whose two samples are both still in samples."""
+    keep = previous['sample1'].astype(str).isin(samples) & previous['sample2'].astype(str).isin(samples)
+    return previous[keep.to_numpy()].reset_index(drop=True)
+
+
+def encode_samples(s, samples=None):
+    """Encodes sample IDs as integer codes, extending an existing sample index if given.
+
+    Returns the codes of both columns and the sample of each code.
+    """
+    names = pd.concat([s['sample1'], s['sample2']], ignore_index=True).astype(str)
+    if samples is None:
+        codes, samples = pd.factorize(names)
+    else:
+        codes = samples.get_indexer(names)
+        if (codes < 0).any():
+            samples = samples.append(pd.Index(pd.unique(names[codes < 0])))
+            codes = samples.get_indexer(names)
+    return codes[:len(s)], codes[len(s):], samples
 
-def calculate_transmission_events(s, snps_per_day, min_snps):
+
+def pair_keys(low, high):
+    """Maps (low, high) code pairs with low < high to a unique int64 key (upper-triangle index)."""
+    high = high.astype(np.int64)
+    return high * (high - 1) // 2 + low
+
+
+def mark_seen(keys, seen=None):
+    """Flags the first occurrence of each pair key and records it in a bitset.
+
+    The upper-triangle index only grows as new samples appear, so the bitset is extended, never rebuilt.
+    Its size depends on the number of samples, not on the number of rows.
+    """
+    if seen is None:
+        seen = np.zeros(0, dtype=np.uint8)
+    first = ~pd.Series(keys).duplicated().to_numpy()
+    if len(keys) == 0:
+        return first, seen
+
+    size = int(keys.max()) // 8 + 1
+    if size > len(seen):
+        seen = np.concatenate([seen, np.zeros(max(size, 2 * len(seen)) - len(seen), dtype=np.uint8)])
+
+    byte, bit = keys >> 3, (keys & 7).astype(np.uint8)
+    first &= (seen[byte] >> bit) & 1 == 0
+    np.bitwise_or.at(seen, byte[first], np.left_shift(1, bit[first]).astype(np.uint8))
+    return first, seen
+
+
+def snp_cutoff(snps_per_day, min_snps, thresholds=SNP_THRESHOLDS):
+    """What a pair needs to be positive in any output column: (below, snps_per_day).
+
+    A pair is a transmission if snps < min_snps, snps <= the expected SNPs or snps is within the CI, which
+    depends on its own date difference. Every other column needs snps < a SNP threshold or a transmission.
+    """
+    below = max([min_snps] + list(thresholds))
+    return below, snps_per_day
+
+
+def index_metadata(m):
+    """Indexes metadata by sampleid, with dates as datetime64[D] and patient IDs as integer codes (-1 if missing).
+
+    Duplicated sampleids keep their first row.
+    """
+    m = m.drop_duplicates(subset='sampleid')
+    index = pd.Index(m['sampleid'].astype(str))
+    dates = pd.to_datetime(m['samplingdate'], format='%Y-%m-%d', errors='coerce').to_numpy().astype('datetime64[D]')
+    pat_ids = pd.factorize(m['pat_id'])[0] if 'pat_id' in m.columns else None
+    return index, dates, pat_ids
+
+
+def lookup_metadata(metadata, samples):
+    """Gathers dates and patient ID codes for each sample code. Samples without metadata get NaT / -1."""
+    index, dates, pat_ids = metadata
+    pos = index.get_indexer(samples)
+    missing = pos < 0
+
+    sample_dates = np.take(dates, pos)
+    sample_dates[missing] = np.datetime64('NaT')
+    if pat_ids is None:
+        return sample_dates, None
+
+    sample_pat_ids = np.take(pat_ids, pos)
+    sample_pat_ids[missing] = -1
+    return sample_dates, sample_pat_ids
+
+
+def calculate_transmission_events(s, snps_per_day, min_snps, thresholds=SNP_THRESHOLDS, days_thresholds=DAYS_THRESHOLDS):
     """Calculates transmission events based on accumulated SNPs and adds a 'transmission' column."""
     # Calculate expected accumulated SNPs
     expected_snps = s["date_diff"] * snps_per_day
@@ -82,37 +232,164 @@ def calculate_transmission_events(s, snps_per_day, min_snps):
     upper_bound = expected_snps * (1 + 0.05)
 
     s['expected_snps'] = expected_snps
-    s['CI'] = lower_bound.astype(str) + '-' + upper_bound.astype(str)
-    
+    s['CI_lower'] = lower_bound
+    s['CI_upper'] = upper_bound
+
     # set transmission to 1 if:
     # snps are <= expected snps
     # snps fall within CI range
-    s['transmission'] = np.where(
-        (s['snps'] <= expected_snps) | 
-        ((s['snps'] >= lower_bound) & (s['snps'] <= upper_bound)) |
-        (s['snps'] < min_snps), 
-        1, 
-        0
-    )
-
-    # Add transmission for SNP thresholds
-    thresholds = [10, 20, 30, 100]
-    for t in thresholds:
-        s[f'transmission_{t}SNP'] = np.where(s['snps'] < t, 1, 0)
-
-    # Add transmission for date thresholds
-    days_thresholds = [90, 180, 270, 365]
-    for d in days_thresholds:
-        s[f'transmission_{d}d'] = np.where((s['date_diff'] < d) & (s['transmission'] == 1), 1, 0)
+    transmission = ((s['snps'] <= expected_snps) |
+                    ((s['snps'] >= lower_bound) & (s['snps'] <= upper_bound)) |
+                    (s['snps'] < min_snps)).to_numpy()
+
+    # Add transmission for SNP and date thresholds, from one packed flag per row
+    thresholds = list(dict.fromkeys(thresholds))
+    days_thresholds = list(dict.fromkeys(days_thresholds))
+    if len(thresholds) + len(days_thresholds) > 63:
+        raise ValueError("At most 63 SNP and days thresholds are supported.")
+    flags = threshold_flags(s['snps'].to_numpy(), thresholds)
+    flags |= threshold_flags(s['date_diff'].to_numpy(), days_thresholds, transmission) << np.uint64(len(thresholds))
+
+    s['transmission'] = transmission.astype(np.uint8)
+    columns = output_columns(thresholds, days_thresholds)
+    for bit, c in enumerate(columns[len(TE_COLUMNS):]):
+        s[c] = ((flags >> np.uint64(bit)) & np.uint64(1)).astype(np.uint8)
+
+    return s[columns]
+
+
+def output_columns(thresholds=SNP_THRESHOLDS, days_thresholds=DAYS_THRESHOLDS):
+    """Columns of the transmission-event table: TE_COLUMNS, then one flag per SNP and days threshold."""
+    return TE_COLUMNS + [f'transmission_{t}SNP' for t in dict.fromkeys(thresholds)] + \
+        [f'transmission_{d}d' for d in dict.fromkeys(days_thresholds)]
+
+
+def threshold_flags(values, thresholds, mask=None):
+    """Packs values < threshold into one bit per threshold (bit i for thresholds[i]), in a single pass.
+
+    The thresholds a value is below are always the largest ones, so one searchsorted over the sorted
+    thresholds indexes a precomputed table of bit masks. Rows where mask is False get no bits.
+    """
+    order = np.argsort(thresholds, kind='stable')
+    sorted_thresholds = np.asarray(thresholds)[order]
+    bits = np.left_shift(np.uint64(1), order.astype(np.uint64))
+
+    # masks[k]: bits of all thresholds from the k-th smallest upwards
+    masks = np.zeros(len(thresholds) + 1, dtype=np.uint64)
+    for k in range(len(thresholds) - 1, -1, -1):
+        masks[k] = masks[k + 1] | bits[k]
+
+    flags = masks[np.searchsorted(sorted_thresholds, values, side='right')]
+    if mask is not None:
+        flags[~mask] = 0
+    return flags
+
+
+def save_results(s, output_file, header=True):
+    """Saves the results to a TSV or Parquet file (by extension). TSV output is appended when header is False."""
+    if te_format(output_file) == 'parquet':
+        write_te(s, output_file)
+    else:
+        add_ci_string(s).to_csv(output_file, index=False, sep='\t', header=header, mode='w' if header else 'a')
+
+
+def classify_chunks(snp_dists_path, metadata, snps_per_day, min_snps, chunksize, cutoff=None,
+                    thresholds=SNP_THRESHOLDS, days_thresholds=DAYS_THRESHOLDS, known=None):
+    """Yields the transmission events of a snp-dists file, chunksize rows at a time."""
+    samples, seen = None, None
+    for chunk in pd.read_csv(snp_dists_path, delimiter="\t", header=None, chunksize=chunksize):
+        chunk, samples, seen = prepare_chunk(chunk, metadata, samples, seen, cutoff, known)
+        yield calculate_transmission_events(chunk, snps_per_day, min_snps, thresholds, days_thresholds)
+
+
+def process_chunks(snp_dists_path, metadata, output_file, snps_per_day, min_snps, chunksize, cutoff=None,
+                   thresholds=SNP_THRESHOLDS, days_thresholds=DAYS_THRESHOLDS, previous=None):
+    """Streams SNP distances through preparation and classification, writing each chunk as it is done.
+
+    Rows of a previous table are written first and their pairs are not classified again.
+    """
+    writer = None
+
+    known = None if previous is None else sample_pairs(previous)
+    chunks = classify_chunks(snp_dists_path, metadata, snps_per_day, min_snps, chunksize, cutoff, thresholds,
+                             days_thresholds, known)
+    if previous is not None:
+        chunks = chain([previous], chunks)
+
+    for i, chunk in enumerate(chunks):
+        if te_format(output_file) == 'parquet':
+            table = compact_table(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(output_file, table.schema, compression='zstd')
+            writer.write_table(table)
+        else:
+            save_results(chunk, output_file, header=i == 0)
+
+    if writer is not None:
+        writer.close()
+
+
+def read_previous(previous_file, thresholds=SNP_THRESHOLDS, days_thresholds=DAYS_THRESHOLDS):
+    """Reads the transmission events of a previous run, checking they have the columns of this run."""
+    previous = add_ci_bounds(read_te(previous_file))
+    if list(previous.columns) != output_columns(thresholds, days_thresholds):
+        raise ValueError(f"Columns of {previous_file} do not match the thresholds, rerun without --incremental.")
+    return previous
+
+
+def process_file(snp_dists_path, metadata, options):
+    """Writes the transmission events of one snp-dists file next to it. Returns the output path."""
+    output_file = f"{os.path.splitext(snp_dists_path)[0]}_te.{options.format}"
+    cutoff = None if options.keep_all_pairs else snp_cutoff(options.snps, options.min_snps, options.thresholds)
 
-    return s[['sample1', 'sample2', 'transmission', 'snps', 'expected_snps', 'CI', 'date_diff'] + 
-             [f'transmission_{t}SNP' for t in thresholds] + 
-             [f'transmission_{d}d' for d in days_thresholds]]
+    # Reuse the pairs classified by the previous run
+    previous_file = previous_output(output_file) if options.incremental else None
+    previous = None if previous_file is None else read_previous(previous_file, options.thresholds,
+                                                                 options.days_thresholds)
+    release_output(output_file)
 
+    if options.chunksize:
+        # Stream SNP distances in bounded-memory chunks, dropping previous pairs of samples no longer in the file
+        if previous is not None:
+            previous = keep_samples(previous, file_samples(snp_dists_path, options.chunksize))
+        process_chunks(snp_dists_path, metadata, output_file, options.snps, options.min_snps, options.chunksize,
+                       cutoff, options.thresholds, options.days_thresholds, previous)
+    else:
+        # Load SNP distances, prepare and clean data
+        s = pd.read_csv(snp_dists_path, delimiter="\t", header=None)
+        if previous is not None:
+            # Drop previous pairs of samples no longer in the file
+            previous = keep_samples(previous, dists_samples(s))
+        known = None if previous is None else sample_pairs(previous)
+        s, _, _ = prepare_chunk(s, metadata, cutoff=cutoff, known=known)
 
-def save_results(s, output_file):
-    """Saves the results to a TSV file."""
-    s.to_csv(output_file, index=False, sep='\t')
+        # Calculate transmission events
+        s = calculate_transmission_events(s, options.snps, options.min_snps, options.thresholds,
+                                          options.days_thresholds)
+        if previous is not None:
+            s = pd.concat([previous, s], ignore_index=True)
+
+        # Save the results
+        save_results(s, output_file)
+
+    if options.incremental:
+        save_snapshot(output_file)
+    return output_file
+
+
+# indexed metadata of each worker process, set once by init_worker
+worker_metadata = None
+
+
+def init_worker(metadata):
+    """Stores the indexed metadata in a worker process."""
+    global worker_metadata
+    worker_metadata = metadata
+
+
+def process_file_worker(snp_dists_path, options):
+    """Runs process_file in a worker process against its stored metadata."""
+    return process_file(snp_dists_path, worker_metadata, options)
 
 
 def main():
@@ -122,18 +399,17 @@ def main():
     # Start measuring time
     start_time = time.time()
 
-    # Load SNP distances and metadata
-    s, m = load_data(options.snp_dists, options.data)
-
-    # Prepare and clean data
-    s = prepare_data(s, m)
-
-    # Calculate transmission events
-    s = calculate_transmission_events(s, options.snps, options.min_snps)
-
-    # Save the results
-    output_file = f"{os.path.splitext(options.snp_dists)[0]}_te.tsv"
-    save_results(s, output_file)
+    # Load and index metadata once for all snp-dists files
+    metadata = index_metadata(load_metadata(options.data))
+
+    if options.jobs > 1 and len(options.snp_dists) > 1:
+        with ProcessPoolExecutor(max_workers=options.jobs, initializer=init_worker, initargs=(metadata,)) as executor:
+            futures = [executor.submit(process_file_worker, path, options) for path in options.snp_dists]
+            for future in futures:
+                print(f"Written {future.result()}")
+    else:
+        for path in options.snp_dists:
+            print(f"Written {process_file(path, metadata, options)}")
 
     # Measure and print running time
     running_time = time.time() - start_time
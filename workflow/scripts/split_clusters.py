@@ -20,55 +20,188 @@ def get_options():
                       default=6,
                       type=int,
                       help='Minimum required number of sequences per cluster')
+  parser.add_argument('--link_mode',
+                      default='copy',
+                      choices=['copy', 'hardlink', 'reflink', 'none'],
+                      help='How fasta files are put in the cluster directories: copied, hard linked, reflinked '
+                           '(copy-on-write clone), or not at all (rfile.txt and names.txt only)')
+  parser.add_argument('--jobs',
+                      default=1,
+                      type=int,
+                      help='Number of clusters written in parallel. Finished clusters are recorded in '
+                           'clusters/.split_manifest.tsv and skipped by reruns while unchanged')
   
   return parser.parse_args()
 
 if __name__ == "__main__":
   options = get_options()
 
+  import fcntl
+  import hashlib
   import os
   import shutil
+  import time
+  from concurrent.futures import ThreadPoolExecutor, as_completed
   import pandas as pd
 
-  def split_files(dir_path, txt_file, rfile, new_dir_path, min_seq_per_cluster):
+  # Linux ioctl cloning a file's extents (reflink) on copy-on-write filesystems (btrfs, xfs)
+  FICLONE = 0x40049409
+
+  def write_if_changed(path, text):
+    # leave the file (and its timestamp) alone if it already has this content, returns the bytes written
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == text:
+                return 0
+    with open(path, 'w') as f:
+        f.write(text)
+    return len(text.encode())
+
+  def is_copy(src, dst):
+    # copy2 keeps the modification time, so same size and mtime means dst is a copy (or link) of src
+    if not os.path.exists(dst):
+        return False
+    if os.path.samefile(src, dst):
+        return True
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+  def place_file(src, dst, link_mode):
+    # put src at dst by copying, hard linking or reflinking it (falls back to a copy if not possible)
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif link_mode == 'reflink':
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+
+  def cluster_digest(names_text, rfile_text, sources, link_mode):
+    # fingerprint of everything a cluster directory is made from: its files and the fasta files it holds
+    digest = hashlib.sha256(f"{link_mode}\n{names_text}\n{rfile_text}".encode())
+    if link_mode != 'none':
+        for src in sources:
+            try:
+                stat = os.stat(src)
+                digest.update(f"{src}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
+            except OSError:
+                digest.update(f"{src}\tmissing\n".encode())
+    return digest.hexdigest()
+
+  def read_manifest(manifest_path):
+    # completed clusters and their digests, the last entry of a cluster wins
+    done = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest:
+            for line in manifest:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) == 2:
+                    done[fields[0]] = fields[1]
+    return done
+
+  def split_cluster(cluster, names, rfile_text, sources, cluster_dir, link_mode):
+    # write one cluster directory, returns the number of bytes written (or linked)
+    written = 0
+    os.makedirs(cluster_dir, exist_ok=True)
+
+    # save txt file with filenames without extension for this cluster names.txt
+    # files are only rewritten when their content changes, so that unchanged clusters keep their
+    # timestamps and snakemake reuses all their downstream results
+    names_file_path = os.path.join(cluster_dir, 'names.txt')
+    if os.path.exists(names_file_path):
+        with open(names_file_path) as names_file:
+            new_names = set(names) - set(names_file.read().split('\n'))
+        if new_names:
+            print(f"Cluster {cluster}: {len(new_names)} new sequences")
+    written += write_if_changed(names_file_path, '\n'.join(names))
+
+    # save rfile for this cluster, it points at the original fasta paths
+    rfile_file_path = os.path.join(cluster_dir, 'rfile.txt')
+    written += write_if_changed(rfile_file_path, rfile_text)
+
+    # the pipeline only reads the rfile, so the fasta files do not need to be in the cluster directory
+    if link_mode == 'none':
+        return written
+
+    # copy (or link) the fasta files for this cluster to the new directory, unless already there
+    for src in sources:
+        if os.path.exists(src):
+            dst = os.path.join(cluster_dir, os.path.basename(src))
+            if not is_copy(src, dst):
+                if os.path.exists(dst):
+                    os.remove(dst)
+                place_file(src, dst, link_mode)
+                written += os.path.getsize(src)
+        else:
+            print(f"File '{os.path.basename(src)}' not found in the fasta directory.")
+    return written
+
+  def split_files(dir_path, txt_file, rfile, new_dir_path, min_seq_per_cluster, link_mode='copy', jobs=1):
+    start_time = time.time()
+
     # load files
     df = pd.read_csv(txt_file, sep=',', header=None, names=['Taxon', 'Cluster'])
     r = pd.read_csv(rfile, sep='\t', header=None, names=['Strain', 'Fasta_Path'])
 
-    # group by cluster and count the number of taxon
-    clusters = df.groupby('Cluster')['Taxon'].count()
+    # rfile rows of each cluster, in rfile order, from a single merge and groupby
+    assignments = df.drop_duplicates()
+    rfiles = dict(list(r.merge(assignments, left_on='Strain', right_on='Taxon')
+                        .groupby('Cluster')[['Strain', 'Fasta_Path']]))
+
+    # clusters finished by previous (possibly interrupted) runs
+    clusters_dir = os.path.join(new_dir_path, 'clusters')
+    os.makedirs(clusters_dir, exist_ok=True)
+    manifest_path = os.path.join(clusters_dir, '.split_manifest.tsv')
+    done = read_manifest(manifest_path)
 
-    # iterate through the clusters that have at least min_seq_per_cluster sequences
-    for cluster, count in clusters[clusters >= min_seq_per_cluster].items():
+    # iterate through the clusters that have at least min_seq_per_cluster sequences, in one groupby pass
+    tasks, skipped = {}, 0
+    for cluster, cluster_strains in df.groupby('Cluster')['Taxon']:
+        if len(cluster_strains) < min_seq_per_cluster:
+            continue
         # get filenames for this cluster
-        filenames = df[df['Cluster'] == cluster]['Taxon'].values + '.fna'
-        # get strains for this cluster
-        cluster_strains = df[df['Cluster'] == cluster]['Taxon']
-
-        # filter rfile for strains in this cluster
-        cluster_rfile = r[r['Strain'].isin(cluster_strains)]
-
-        # create the directory for this cluster
-        cluster_dir = os.path.join(new_dir_path, 'clusters', str(cluster))
-        os.makedirs(cluster_dir, exist_ok=True)
-        
-        # save txt file with filenames without extension for this cluster names.txt
-        names_file_path = os.path.join(cluster_dir, 'names.txt')
-        with open(names_file_path, 'w') as names_file:
-            names_file.write('\n'.join([os.path.splitext(f)[0] for f in filenames]))
-
-        # save rfile for this cluster
-        rfile_file_path = os.path.join(cluster_dir, 'rfile.txt')
-        cluster_rfile.to_csv(rfile_file_path, sep='\t', header=False, index=False)
-
-        # copy the fasta files for this cluster to the new directory
-        for filename in filenames:
-            src = os.path.join(dir_path, filename)
-            if os.path.exists(src):
-                dst = os.path.join(cluster_dir, filename)
-                shutil.copy2(src, dst)
-            else:
-                print(f"File '{filename}' not found in the fasta directory.")
-
-  split_files(options.dir_path, options.txt_file, options.rfile, options.new_dir_path, options.min_seq_per_cluster)
+        filenames = cluster_strains.values + '.fna'
+        names = [os.path.splitext(f)[0] for f in filenames]
+        sources = [os.path.join(dir_path, f) for f in filenames]
+        # rfile for strains in this cluster
+        rfile_text = rfiles.get(cluster, r.iloc[:0]).to_csv(sep='\t', header=False, index=False)
+
+        cluster_dir = os.path.join(clusters_dir, str(cluster))
+        digest = cluster_digest('\n'.join(names), rfile_text, sources, link_mode)
+        # skip clusters that are finished and unchanged
+        if done.get(str(cluster)) == digest and os.path.isdir(cluster_dir):
+            skipped += 1
+            continue
+        tasks[str(cluster)] = (digest, (cluster, names, rfile_text, sources, cluster_dir, link_mode))
+
+    # write the cluster directories on a pool of workers, recording each finished cluster in the manifest
+    written, finished = 0, 0
+    report_every = max(1, len(tasks) // 20)
+    with ThreadPoolExecutor(max_workers=jobs) as executor, open(manifest_path, 'a') as manifest:
+        futures = {executor.submit(split_cluster, *args): cluster for cluster, (_, args) in tasks.items()}
+        for future in as_completed(futures):
+            cluster = futures[future]
+            written += future.result()
+            manifest.write(f"{cluster}\t{tasks[cluster][0]}\n")
+            manifest.flush()
+            finished += 1
+            if finished % report_every == 0 or finished == len(tasks):
+                print(f"{finished}/{len(tasks)} clusters written")
+
+    # throughput
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"Split {finished} clusters ({skipped} finished and unchanged, skipped) in {elapsed:.2f} s: "
+          f"{finished / elapsed:.1f} clusters/s, {written / elapsed / 1e6:.1f} MB/s")
+
+  split_files(options.dir_path, options.txt_file, options.rfile, options.new_dir_path, options.min_seq_per_cluster,
+              options.link_mode, options.jobs)
   print("done")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+'''Transmission clusters (connected components) of the whole dataset, for every transmission column'''
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from te_io import flag_columns, read_te, te_format
+
+
+def get_options():
+    """Parses command line arguments."""
+    description = 'Cluster IDs of every sample for each transmission column, from a transmission-event table'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('te', help='Transmission-event table, e.g. out/te_merged.tsv (TSV or Parquet)')
+    parser.add_argument('output', help='Membership table: sample, then one cluster ID column per transmission '
+                                       'column (TSV, or Parquet with a .parquet extension)')
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help='Transmission columns to cluster on (default: all transmission* columns)')
+
+    return parser.parse_args()
+
+
+def find_roots(parent):
+    """Points every element of a disjoint-set forest directly at its root (pointer jumping)."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent = grandparent
+
+
+def union_find(n, u, v):
+    """Root of the set of each element 0..n-1 after joining every pair u[i], v[i].
+
+    Array-based disjoint sets: every round flattens the forest, then hooks the larger root of each
+    still separate pair onto the smaller one. Roots only get smaller, so no cycles can form.
+    """
+    parent = np.arange(n)
+    while True:
+        parent = find_roots(parent)
+        ru, rv = parent[u], parent[v]
+        separate = ru != rv
+        if not separate.any():
+            return parent
+        # pairs already joined are done for good
+        u, v, ru, rv = u[separate], v[separate], ru[separate], rv[separate]
+        np.minimum.at(parent, np.maximum(ru, rv), np.minimum(ru, rv))
+
+
+def cluster_ids(roots):
+    """Renumbers set roots as cluster IDs 0, 1, ... by decreasing cluster size, ties by first sample."""
+    codes, _ = pd.factorize(roots)
+    sizes = np.bincount(codes)
+    rank = np.empty(len(sizes), dtype=np.int64)
+    rank[np.argsort(-sizes, kind='stable')] = np.arange(len(sizes))
+    ids = rank[codes]
+    return ids.astype(np.min_scalar_type(max(len(sizes) - 1, 0)))
+
+
+def te_clusters(te, columns):
+    """Membership table: each sample (in order of first appearance) and its cluster ID per column.
+
+    Samples are integer coded once; the pairs of all columns are clustered together in one union-find
+    over (column, sample) elements, as column c uses elements c * n_samples to (c + 1) * n_samples - 1.
+    Samples without any transmission in a column are clusters of their own.
+    """
+    codes, samples = pd.factorize(pd.concat([te['sample1'], te['sample2']], ignore_index=True))
+    n = len(samples)
+    first, second = codes[:len(te)], codes[len(te):]
+
+    u, v = [], []
+    for c, column in enumerate(columns):
+        linked = (te[column] == 1).to_numpy()
+        u.append(first[linked] + c * n)
+        v.append(second[linked] + c * n)
+    roots = union_find(len(columns) * n, np.concatenate(u or [[]]).astype(np.int64),
+                       np.concatenate(v or [[]]).astype(np.int64))
+
+    membership = pd.DataFrame({'sample': samples})
+    for c, column in enumerate(columns):
+        membership[column] = cluster_ids(roots[c * n:(c + 1) * n])
+    return membership
+
+
+def main():
+    options = get_options()
+
+    te = read_te(options.te)
+    columns = options.columns or flag_columns(te)
+    missing = [c for c in columns if c not in te.columns]
+    if missing:
+        raise ValueError(f"Transmission columns not found in {options.te}: {', '.join(missing)}")
+
+    membership = te_clusters(te, columns)
+    if te_format(options.output) == 'parquet':
+        membership.to_parquet(options.output, index=False, compression='zstd')
+    else:
+        membership.to_csv(options.output, index=False, sep='\t')
+
+    for column in columns:
+        sizes = membership[column].value_counts()
+        print(f"{column}: {(sizes > 1).sum()} clusters of 2 or more samples, largest {sizes.max()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+'''Read and write transmission-event tables as TSV or compact Parquet'''
+
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# dtypes of the numeric columns, so that a header-only TSV reads with the same schema as a full one
+NUMERIC_DTYPES = {'snps': np.int64, 'expected_snps': np.float64, 'date_diff': np.int64}
+
+# schema metadata key holding the names of the packed flag columns (bit 0 first) and the original column order
+LAYOUT_KEY = b'tenet_layout'
+
+
+def te_format(path):
+    """Returns 'parquet' for .parquet files and 'tsv' otherwise."""
+    return 'parquet' if str(path).endswith('.parquet') else 'tsv'
+
+
+def flag_columns(s):
+    """Names of the 0/1 transmission columns, in table order."""
+    return [c for c in s.columns if c.startswith('transmission')]
+
+
+def flags_dtype(n):
+    """Smallest unsigned integer type with at least n bits."""
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"Cannot pack {n} flag columns into 64 bits.")
+
+
+def add_ci_bounds(s):
+    """Adds numeric CI_lower / CI_upper columns (recomputed from expected_snps) in place of a string CI column."""
+    if 'CI' not in s.columns:
+        return s
+    s = s.copy()
+    pos = s.columns.get_loc('CI')
+    s.insert(pos, 'CI_lower', s['expected_snps'] * (1 - 0.05))
+    s.insert(pos + 1, 'CI_upper', s['expected_snps'] * (1 + 0.05))
+    return s.drop(columns=['CI'])
+
+
+def add_ci_string(s):
+    """Replaces CI_lower / CI_upper with the 'lower-upper' string CI column of the TSV output."""
+    if 'CI_lower' not in s.columns:
+        return s
+    s = s.copy()
+    s.insert(s.columns.get_loc('CI_lower'), 'CI', s['CI_lower'].astype(str) + '-' + s['CI_upper'].astype(str))
+    return s.drop(columns=['CI_lower', 'CI_upper'])
+
+
+def compact_table(s):
+    """Converts a transmission-event table to a compact Arrow table.
+
+    Sample IDs are dictionary encoded, the CI is kept as two numeric columns and the transmission columns
+    are packed into a single 'flags' integer column, one bit per column.
+    """
+    s = add_ci_bounds(s)
+    columns = list(s.columns)
+    flags = flag_columns(s)
+    dtype = flags_dtype(len(flags))
+
+    packed = np.zeros(len(s), dtype=dtype)
+    for bit, c in enumerate(flags):
+        packed |= s[c].to_numpy().astype(dtype) << dtype(bit)
+
+    s = s.drop(columns=flags).assign(flags=packed)
+    table = pa.Table.from_pandas(s, preserve_index=False)
+    for c in ('sample1', 'sample2'):
+        i = table.schema.get_field_index(c)
+        table = table.set_column(i, c, table.column(c).cast(pa.string()).dictionary_encode()
+                                 .cast(pa.dictionary(pa.int32(), pa.string())))
+    layout = {'flags': flags, 'columns': columns}
+    return table.replace_schema_metadata({LAYOUT_KEY: json.dumps(layout).encode()})
+
+
+def expand_table(table):
+    """Converts a compact Arrow table back to a DataFrame with one uint8 column per transmission flag."""
+    layout = json.loads(table.schema.metadata[LAYOUT_KEY])
+    s = table.to_pandas()
+    packed = s.pop('flags').to_numpy()
+
+    for bit, c in enumerate(layout['flags']):
+        s[c] = ((packed >> packed.dtype.type(bit)) & 1).astype(np.uint8)
+    return s[layout['columns']]
+
+
+def read_te(path, columns=None):
+    """Reads a transmission-event table (TSV or Parquet) with one column per transmission flag."""
+    if te_format(path) == 'parquet':
+        s = expand_table(pq.read_table(path))
+    else:
+        s = pd.read_csv(path, sep='\t', float_precision='round_trip', dtype=NUMERIC_DTYPES)
+        s = s.astype({c: np.int64 for c in flag_columns(s)})
+    return s if columns is None else s[columns]
+
+
+def write_te(s, path):
+    """Writes a transmission-event table as TSV or compact Parquet, depending on the file extension."""
+    if te_format(path) == 'parquet':
+        pq.write_table(compact_table(s), path, compression='zstd')
+    else:
+        add_ci_string(s).to_csv(path, index=False, sep='\t')
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+'''Build transmission-event networks from TE tables in bulk'''
+
+import hashlib
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.sparse import diags, triu as sparse_triu
+from scipy.sparse.linalg import splu
+
+
+# node attribute -> column prefix in the TE table (suffixed 1 / 2 for sample1 / sample2)
+NODE_ATTRIBUTES = {
+    'ST': 'ST',
+    'loc': 'hospital_loc',
+    'collection': 'collection',
+    'r': 'resistance',
+    'v': 'virulence',
+    'source': 'isolation_source',
+}
+
+
+def node_table(te):
+    """One row of node attributes per sample, in order of first appearance (sample1 before sample2 per row)."""
+    sides = []
+    for i in ('1', '2'):
+        side = pd.DataFrame({attr: te[f'{prefix}{i}'].to_numpy() for attr, prefix in NODE_ATTRIBUTES.items()})
+        side.insert(0, 'node', te[f'sample{i}'].to_numpy())
+        side['order'] = np.arange(len(te)) * 2 + int(i) - 1
+        sides.append(side)
+    nodes = pd.concat(sides, ignore_index=True).sort_values('order')
+
+    order = pd.unique(nodes['node'])
+    # attributes are per sample, keep the last seen like repeated add_node calls would
+    return nodes.drop_duplicates(subset='node', keep='last').set_index('node').drop(columns='order').loc[order]
+
+
+def build_graph(nodes, edges, edge_attr=None):
+    """Graph with every node of the node table and one edge per row of edges (sample1, sample2)."""
+    G = nx.Graph()
+    G.add_nodes_from(zip(nodes.index, nodes.to_dict('records')))
+    G.update(nx.from_pandas_edgelist(edges, 'sample1', 'sample2', edge_attr=edge_attr))
+    return G
+
+
+def month_graphs(te, edge_column):
+    """Builds each month's networks once.
+
+    Returns {month: (G, T)} where G has an edge for every pair (weight = edge_column), used for network
+    parameters, and T keeps only pairs with edge_column == 1 (weight = snps), used for plotting.
+    Both share the month's nodes and node attributes.
+    """
+    graphs = {}
+    for month, month_data in te.groupby("month"):
+        nodes = node_table(month_data)
+        edges = month_data[['sample1', 'sample2', edge_column, 'snps']]
+
+        G = build_graph(nodes, edges.rename(columns={edge_column: 'weight'}), 'weight')
+        T = build_graph(nodes, edges[edges[edge_column] == 1].rename(columns={'snps': 'weight'}), 'weight')
+        graphs[month] = (G, T)
+    return graphs
+
+
+# network parameters: output column -> per-node centrality function
+CENTRALITIES = {
+    'degrees_centrality': nx.degree_centrality,
+    'closeness_centrality': nx.closeness_centrality,
+    'betweenness_centrality': nx.betweenness_centrality,
+    'current_flow_betweenness_centrality': nx.current_flow_betweenness_centrality,
+    'load_centrality': nx.load_centrality,
+    'harmonic_centrality': nx.harmonic_centrality,
+}
+
+
+# max dense entries (sources x nodes, or nodes x edges) handled at once by the sparse backend
+SPARSE_BLOCK = 2**22
+
+
+def bfs_levels(A, sources, paths=True):
+    """Batched BFS from sources on a symmetric CSR adjacency matrix, expanding only the frontier.
+
+    Each hop gathers the edges out of the frontier, so a batch costs O(sources * edges) whatever the
+    diameter. Returns levels, the (source row, node) arrays of the nodes first reached at each hop count
+    (levels[0] are the sources). With paths, also the shortest-path DAG, the (source row, predecessor,
+    node) arrays of the edges into each level, and sigma and preds (sources x nodes): the number of
+    shortest paths to each node and of its predecessors (neighbours one hop closer to the source).
+    """
+    b, n = len(sources), A.shape[0]
+    degree = np.diff(A.indptr)
+    rows = np.arange(b)
+    seen = np.zeros((b, n), dtype=bool)
+    seen[rows, sources] = True
+    levels, dag = [(rows, np.asarray(sources))], [None]
+    sigma = preds = None
+    if paths:
+        sigma, preds = np.zeros((b, n)), np.zeros((b, n))
+        sigma[rows, sources] = 1
+
+    while True:
+        row, node = levels[-1]
+        # every edge out of the frontier that leads to a node not reached yet
+        count = degree[node]
+        offset = np.repeat(A.indptr[node] - np.cumsum(count) + count, count) + np.arange(count.sum())
+        row, pred, node = np.repeat(row, count), np.repeat(node, count), A.indices[offset]
+        new = ~seen[row, node]
+        if not new.any():
+            return levels, dag, sigma, preds
+        row, pred, node = row[new], pred[new], node[new]
+
+        reached, inverse = np.unique(row.astype(np.int64) * n + node, return_inverse=True)
+        reached_row, reached_node = np.divmod(reached, n)
+        seen[reached_row, reached_node] = True
+        levels.append((reached_row, reached_node))
+        if paths:
+            sigma[reached_row, reached_node] = np.bincount(inverse, weights=sigma[row, pred])
+            preds[reached_row, reached_node] = np.bincount(inverse)
+            dag.append((row, pred, node))
+
+
+def dependencies(dag, shape, share, gain=None):
+    """Back-propagates dependencies along the shortest-path DAG from the farthest level, summed over
+    sources and nodes.
+
+    A node passes (1 + its dependency) * share to each predecessor, which multiplies what it receives by
+    gain; the sources themselves are left out.
+    """
+    delta = np.zeros(shape)
+    for row, pred, node in reversed(dag[2:]):
+        sent = (1 + delta[row, node]) * share[row, node]
+        if gain is not None:
+            sent *= gain[row, pred]
+        np.add.at(delta, (row, pred), sent)
+    return delta.sum()
+
+
+def current_flow_sum(A, edges=None):
+    """Sum over the nodes of the normalized current-flow betweenness of a connected graph.
+
+    One sparse solve of the Laplacian grounded at node 0 per edge gives that edge's current for a unit
+    injected at every node; the node sum is, over edges, the sum over node pairs of the current
+    differences, which does not depend on node order. With edges (indices into the upper-triangle
+    edge list), only those are solved and the total is scaled up to all edges.
+    """
+    n = A.shape[0]
+    L = diags(np.asarray(A.sum(axis=1)).ravel()) - A
+    lu = splu(L.tocsc()[1:, 1:])
+
+    u, v = sparse_triu(A, k=1).nonzero()
+    m = len(u)
+    if edges is not None:
+        u, v = u[edges], v[edges]
+    # sum over pairs i<j of |x_i - x_j| = sum of the sorted values weighted by 2k - (n - 1)
+    weights = (2 * np.arange(n) - (n - 1))[:, None]
+
+    total = 0.0
+    step = max(1, SPARSE_BLOCK // n)
+    for start in range(0, len(u), step):
+        block = np.arange(len(u[start:start + step]))
+        rhs = np.zeros((n, len(block)))
+        rhs[u[start:start + step], block] = 1
+        rhs[v[start:start + step], block] = -1
+        flow = np.zeros(rhs.shape)
+        flow[1:] = lu.solve(rhs[1:])
+        total += (np.sort(flow, axis=0) * weights).sum()
+    total *= m / len(u)
+    return (total - n * (n - 1) / 2) * 2 / ((n - 1) * (n - 2))
+
+
+def path_dependencies(dag, sigma, preds, scale):
+    """Betweenness and load centrality sums over all nodes, for the shortest paths found by bfs_levels."""
+    # betweenness splits dependency in proportion to shortest-path counts, load evenly between predecessors
+    return (dependencies(dag, sigma.shape, 1 / sigma.clip(min=1), sigma) * scale,
+            dependencies(dag, preds.shape, 1 / preds.clip(min=1)) * scale)
+
+
+def sparse_centralities(subgraph, pivots=None, rng=None):
+    """Same sums as networkx_centralities, from a CSR adjacency matrix with batched BFS and sparse solves.
+
+    With pivots, betweenness and load are estimated from shortest paths out of that many random source
+    nodes, and current-flow betweenness from that many random edges (k-pivot sampling). Degree,
+    closeness and harmonic centrality stay exact, from a cheaper BFS without path counts.
+    """
+    n = subgraph.number_of_nodes()
+    # networkx's current-flow betweenness divides by zero below 3 nodes
+    if n < 3:
+        return None
+    # nodes in a fixed order, so that the same seed samples the same pivots in every run
+    A = nx.to_scipy_sparse_array(subgraph, nodelist=sorted(subgraph, key=str), weight=None, dtype=float,
+                                 format='csr')
+    scale = 1 / ((n - 1) * (n - 2))
+
+    sampled = None
+    edges = None
+    if pivots is not None:
+        if pivots < n:
+            sampled = np.sort(rng.choice(n, pivots, replace=False))
+            scale *= n / pivots
+        m = int(sparse_triu(A, k=1).nnz)
+        if pivots < m:
+            edges = np.sort(rng.choice(m, pivots, replace=False))
+
+    sums = dict.fromkeys(CENTRALITIES, 0.0)
+    sums['degrees_centrality'] = A.sum() / (n - 1)
+    step = max(1, SPARSE_BLOCK // (n + A.nnz))
+    for start in range(0, n, step):
+        sources = np.arange(start, min(start + step, n))
+        levels, dag, sigma, preds = bfs_levels(A, sources, paths=sampled is None)
+
+        distances = np.zeros(len(sources))
+        for hops, (row, _) in enumerate(levels[1:], start=1):
+            distances += np.bincount(row, minlength=len(sources)) * hops
+            sums['harmonic_centrality'] += len(row) / hops
+        sums['closeness_centrality'] += ((n - 1) / distances).sum()
+
+        if sampled is None:
+            betweenness, load = path_dependencies(dag, sigma, preds, scale)
+            sums['betweenness_centrality'] += betweenness
+            sums['load_centrality'] += load
+
+    # estimates only follow the shortest paths out of the sampled sources
+    if sampled is not None:
+        for start in range(0, len(sampled), step):
+            _, dag, sigma, preds = bfs_levels(A, sampled[start:start + step])
+            betweenness, load = path_dependencies(dag, sigma, preds, scale)
+            sums['betweenness_centrality'] += betweenness
+            sums['load_centrality'] += load
+    sums['current_flow_betweenness_centrality'] = current_flow_sum(A, edges)
+    return sums
+
+
+def networkx_centralities(subgraph):
+    """Sum over the nodes of a connected component of each centrality, or None if any divides by zero."""
+    try:
+        return {name: sum(func(subgraph).values()) for name, func in CENTRALITIES.items()}
+    except ZeroDivisionError:
+        return None
+
+
+# metrics backend -> per-component function
+BACKENDS = {
+    'networkx': networkx_centralities,
+    'sparse': sparse_centralities,
+}
+
+
+def component_parameters(subgraph, seed, backend='networkx', approx=None, pivots=None):
+    """Centrality sums of a connected component and whether they were estimated.
+
+    Components with more than approx nodes are estimated by sampling pivots (default: approx, at
+    least 1) sources and edges with the sparse kernels, random state from seed; smaller ones use the exact
+    backend.
+    """
+    if approx is not None and subgraph.number_of_nodes() > approx:
+        pivots = max(approx if pivots is None else pivots, 1)
+        return sparse_centralities(subgraph, pivots, np.random.default_rng(seed)), True
+    return BACKENDS[backend](subgraph), False
+
+
+def month_digest(G, *settings):
+    """Fingerprint of a network's nodes and edges (independent of their order) and of the metric settings."""
+    digest = hashlib.sha256(repr(settings).encode())
+    for node in sorted(map(str, G.nodes)):
+        digest.update(f"{node}\n".encode())
+    for edge in sorted(tuple(sorted((str(u), str(v)))) for u, v in G.edges):
+        digest.update(f"{edge[0]}\t{edge[1]}\n".encode())
+    return digest.hexdigest()
+
+
+def network_parameters(graphs, jobs=1, backend='networkx', approx=None, seed=0, cache=None, pivots=None):
+    """Average centrality measures per month, over all nodes of the month.
+
+    Each (month, connected component) is an independent work unit; with jobs > 1 they are spread over a
+    process pool. Components whose measures divide by zero add nothing, as before. Workers get a copy of
+    their component, whose neighbour order can move current-flow betweenness in the last digit.
+    backend is a key of BACKENDS; 'sparse' agrees with 'networkx' up to floating-point rounding.
+    With approx, large components are estimated by sampling (see component_parameters); each unit gets
+    its own random state derived from seed and its month, so results do not depend on jobs or other months.
+    The 'mode' column is 'approx' for months with at least one estimated component and 'exact' otherwise.
+
+    cache maps months to the digest and row of a previous run; months whose digest is unchanged are
+    reused instead of recomputed, and the cache is updated in place.
+    """
+    digests = {month: month_digest(G, backend, approx, seed, pivots) for month, (G, _) in graphs.items()}
+    reused = {}
+    if cache is not None:
+        reused = {month: cache[str(month)]['row'] for month in graphs
+                  if cache.get(str(month), {}).get('digest') == digests[month]}
+
+    units, seeds = [], []
+    for month, (G, _) in graphs.items():
+        if month in reused:
+            continue
+        for i, nodes in enumerate(nx.connected_components(G)):
+            units.append((month, G.subgraph(nodes)))
+            seeds.append([seed, zlib.crc32(str(month).encode()), i])
+    parameters = partial(component_parameters, backend=backend, approx=approx, pivots=pivots)
+
+    if jobs > 1 and len(units) > 1:
+        subgraphs = [subgraph.copy() for _, subgraph in units]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(parameters, subgraphs, seeds,
+                                        chunksize=max(1, len(units) // (jobs * 4))))
+    else:
+        results = [parameters(subgraph, unit_seed) for (_, subgraph), unit_seed in zip(units, seeds)]
+
+    sums = {month: [] for month in graphs}
+    approximated = dict.fromkeys(graphs, False)
+    for (month, _), (result, estimated) in zip(units, results):
+        approximated[month] |= estimated
+        if result is not None:
+            sums[month].append(result)
+
+    network_p = []
+    for month, (G, _) in graphs.items():
+        if month in reused:
+            network_p.append(reused[month])
+            continue
+        n = len(G.nodes)
+        row = {'month': month}
+        for name in CENTRALITIES:
+            row[name] = sum(result[name] for result in sums[month]) / n if n > 0 else 0
+        row['mode'] = 'approx' if approximated[month] else 'exact'
+        network_p.append(row)
+        if cache is not None:
+            cache[str(month)] = {'digest': digests[month], 'row': row}
+    return pd.DataFrame(network_p)
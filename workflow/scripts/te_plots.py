@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+'''Headless (Agg) rendering of TENET figures, on a process pool'''
+
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+import seaborn as sns
+
+from te_network import month_digest
+
+FORMATS = ['png', 'svg']
+
+# spring layout parameters of the monthly networks
+LAYOUT_SCALE = 5
+LAYOUT_K = 0.5
+LAYOUT_ITERATIONS = 50
+# fewer iterations when at least half the nodes start from the previous month's positions
+WARM_ITERATIONS = 20
+# networks with more nodes than this are laid out one connected component at a time, packed in rows
+PACK_NODES = 1000
+
+# node colors of the monthly networks, by collection
+COLLECTIONS = {"MHH": "xkcd:lavender", "SRA": "xkcd:turquoise", "CPH": "xkcd:dark blue"}
+
+
+def save_figure(fig, output_prefix, formats=FORMATS, **kwargs):
+    """Saves a figure once per format (output_prefix.png, output_prefix.svg, ...) and closes it."""
+    try:
+        for fmt in formats:
+            fig.savefig(f'{output_prefix}.{fmt}', **kwargs)
+    finally:
+        plt.close(fig)
+
+
+def spring_layout(G, start, seed, scale=LAYOUT_SCALE):
+    """Spring layout of G, nodes in start warm-started from their positions there."""
+    start = {node: start[node] for node in G if node in start}
+    iterations = WARM_ITERATIONS if 2 * len(start) >= len(G) else LAYOUT_ITERATIONS
+    return nx.spring_layout(G, k=LAYOUT_K, pos=start or None, iterations=iterations, scale=scale, dim=2, seed=seed)
+
+
+def packed_layout(G, start, seed):
+    """Lays out each connected component on its own and packs them in rows, largest first.
+
+    Each component gets a square with sides proportional to the square root of its size.
+    """
+    components = sorted(nx.connected_components(G), key=len, reverse=True)
+    sides = [np.sqrt(len(c)) for c in components]
+    width = max(sides[0], np.sqrt(sum(side ** 2 for side in sides)))
+
+    pos, x, y, row = {}, 0.0, 0.0, 0.0
+    for component, side in zip(components, sides):
+        if x + side > width:
+            x, y, row = 0.0, y - row, 0.0
+        nodes = list(component)
+        if len(nodes) == 1:
+            layout = {nodes[0]: np.zeros(2)}
+        elif len(nodes) == 2:
+            layout = {nodes[0]: np.array([-1.0, 0.0]), nodes[1]: np.array([1.0, 0.0])}
+        else:
+            layout = spring_layout(G.subgraph(nodes), start, seed, scale=1)
+        for node, xy in layout.items():
+            pos[node] = xy * side * 0.4 + (x + side / 2, y - side / 2)
+        x, row = x + side, max(row, side)
+    return nx.rescale_layout_dict(pos, scale=LAYOUT_SCALE)
+
+
+def month_layouts(graphs, seed=0, cache=None):
+    """Node positions of each month's network, {month: {node: (x, y)}}, from a fixed seed.
+
+    Months are laid out in order; nodes seen in earlier months start from their last position, so
+    consecutive plots are comparable. Networks larger than PACK_NODES use the packed layout.
+    cache ({digest of nodes and edges: positions}) is updated in place to this run's layouts, and
+    months found in it are not laid out again.
+    """
+    layouts, last, digests = {}, {}, set()
+    for month, G in graphs.items():
+        digest = month_digest(G, 'layout', seed, PACK_NODES)
+        if cache is not None and digest in cache:
+            pos = cache[digest]
+        elif len(G) > PACK_NODES:
+            pos = packed_layout(G, last, seed)
+        else:
+            pos = spring_layout(G, last, seed)
+        if cache is not None:
+            cache[digest] = pos
+            digests.add(digest)
+        layouts[month] = pos
+        last.update(pos)
+    if cache is not None:
+        for digest in set(cache) - digests:
+            del cache[digest]
+    return layouts
+
+
+def draw_month_network(month, G, pos, output_prefix, formats=FORMATS):
+    """Draws one month's transmission network at the given node positions, nodes colored by collection."""
+    # the style of tenet.py, set here as workers started without forking do not inherit it
+    with sns.axes_style('ticks', rc={"axes.facecolor": (0, 0, 0, 0)}), sns.plotting_context('talk'):
+        fig = plt.figure(figsize=(12, 12))
+
+        # draw edges with adjusted lengths
+        nx.draw_networkx_edges(G, pos, width=[2], edge_vmin=0, edge_vmax=10, edge_color='black', alpha=1)
+
+        # draw color-coded nodes based on collection
+        node_colors = [COLLECTIONS['MHH'] if G.nodes[node]["collection"] == "MHH"
+                       else COLLECTIONS['SRA'] if G.nodes[node]["collection"] == "SRA"
+                       else COLLECTIONS['CPH'] for node in G.nodes]
+        nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=150)
+
+        # legend
+        legend_handles = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=color, markersize=10, label=label)
+                          for label, color in COLLECTIONS.items()]
+        plt.legend(handles=legend_handles, loc='upper left', facecolor="white")
+
+        plt.title(f'Month: {month}')
+        save_figure(fig, output_prefix, formats, dpi=150, bbox_inches='tight', transparent=True)
+
+
+def render(draw, tasks, jobs=1):
+    """Calls draw(*task) for each task, on a pool of jobs processes.
+
+    Every draw function closes its figure, so memory is bounded by one figure per process.
+    Errors in a worker are raised here.
+    """
+    tasks = list(tasks)
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            draw(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        for future in [executor.submit(draw, *task) for task in tasks]:
+            future.result()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+'''Network measures over sliding time windows, updated event by event as the window moves'''
+
+from collections import Counter, deque
+from itertools import count
+
+import pandas as pd
+
+WINDOW_COLUMNS = ['window_start', 'window_end', 'nodes', 'edges', 'components', 'largest_component',
+                  'mean_degree', 'max_degree', 'degree_centrality']
+
+
+def add_node(node, adj, comp, members, degrees, ids):
+    """Adds an isolated node, a component of its own."""
+    adj[node] = Counter()
+    comp[node] = next(ids)
+    members[comp[node]] = {node}
+    degrees[0] += 1
+
+
+def remove_node(node, adj, comp, members, degrees):
+    """Removes a node without edges."""
+    del adj[node]
+    del members[comp.pop(node)]
+    degrees[0] -= 1
+
+
+def shift_degree(degrees, degree, delta):
+    """Moves one node from degree to degree + delta in the degree histogram."""
+    degrees[degree] -= 1
+    if not degrees[degree]:
+        del degrees[degree]
+    degrees[degree + delta] += 1
+
+
+def link(u, v, adj, comp, members, degrees):
+    """Adds one event for the pair u-v. Returns True for a new edge.
+
+    A new edge between two components relabels the nodes of the smaller one.
+    """
+    adj[u][v] += 1
+    adj[v][u] += 1
+    if adj[u][v] > 1:
+        return False
+    shift_degree(degrees, len(adj[u]) - 1, 1)
+    shift_degree(degrees, len(adj[v]) - 1, 1)
+
+    cu, cv = comp[u], comp[v]
+    if cu != cv:
+        if len(members[cu]) < len(members[cv]):
+            cu, cv = cv, cu
+        for node in members[cv]:
+            comp[node] = cu
+        members[cu] |= members.pop(cv)
+    return True
+
+
+def unlink(u, v, adj, comp, members, degrees, ids):
+    """Removes one event for the pair u-v. Returns True when the edge is gone.
+
+    Breadth-first searches from u and from v advance in turns: meeting means the component is still
+    connected, otherwise the first search to run out has found the smaller part, which is relabelled.
+    The cost is bounded by the size of that part, not of the whole component.
+    """
+    adj[u][v] -= 1
+    adj[v][u] -= 1
+    if adj[u][v]:
+        return False
+    del adj[u][v], adj[v][u]
+    shift_degree(degrees, len(adj[u]) + 1, -1)
+    shift_degree(degrees, len(adj[v]) + 1, -1)
+
+    seen = ({u}, {v})
+    queues = (deque([u]), deque([v]))
+    while True:
+        for side in (0, 1):
+            if not queues[side]:
+                part = seen[side]
+                members[comp[u]] -= part
+                new = next(ids)
+                members[new] = part
+                for node in part:
+                    comp[node] = new
+                return True
+            for neighbour in adj[queues[side].popleft()]:
+                if neighbour in seen[1 - side]:
+                    return True
+                if neighbour not in seen[side]:
+                    seen[side].add(neighbour)
+                    queues[side].append(neighbour)
+
+
+def window_parameters(te, edge_column, window, step):
+    """Network measures of every time window [start, start + window), starting at the first sampling date
+    (samplingdate1, as for the monthly networks) and moving by step (both pd.Timedelta).
+
+    As in the monthly networks, the nodes of a window are the samples of its events and the edges are the
+    pairs with edge_column == 1. The graph, its connected components and its degree histogram are updated
+    as events enter and leave the window instead of being rebuilt for each one.
+    """
+    window, step = pd.Timedelta(window), pd.Timedelta(step)
+    if window <= pd.Timedelta(0) or step <= pd.Timedelta(0):
+        raise ValueError(f"Window ({window}) and step ({step}) must be positive.")
+
+    te = te[te['samplingdate1'].notna()].sort_values('samplingdate1', kind='stable')
+    dates = te['samplingdate1'].to_numpy(dtype='datetime64[ns]')
+    codes, _ = pd.factorize(pd.concat([te['sample1'], te['sample2']], ignore_index=True))
+    first, second = codes[:len(te)], codes[len(te):]
+    is_edge = (te[edge_column] == 1).to_numpy() & (first != second)
+
+    adj, comp, members, degrees, ids = {}, {}, {}, Counter(), count()
+    events = Counter()
+    edges = 0
+
+    def enter(i):
+        nonlocal edges
+        for node in (first[i], second[i]):
+            if not events[node]:
+                add_node(node, adj, comp, members, degrees, ids)
+            events[node] += 1
+        if is_edge[i]:
+            edges += link(first[i], second[i], adj, comp, members, degrees)
+
+    def leave(i):
+        nonlocal edges
+        if is_edge[i]:
+            edges -= unlink(first[i], second[i], adj, comp, members, degrees, ids)
+        for node in (first[i], second[i]):
+            events[node] -= 1
+            if not events[node]:
+                del events[node]
+                remove_node(node, adj, comp, members, degrees)
+
+    rows = []
+    if len(te):
+        start = pd.Timestamp(dates[0]).normalize()
+        entered = left = 0
+        while start <= dates[-1]:
+            end = start + window
+            while entered < len(dates) and dates[entered] < end.to_datetime64():
+                enter(entered)
+                entered += 1
+            while left < entered and dates[left] < start.to_datetime64():
+                leave(left)
+                left += 1
+
+            n = len(comp)
+            rows.append([start, end, n, edges, len(members), max(map(len, members.values()), default=0),
+                         2 * edges / n if n else 0.0, max(degrees, default=0),
+                         2 * edges / (n * (n - 1)) if n > 1 else 0.0])
+            start += step
+    return pd.DataFrame(rows, columns=WINDOW_COLUMNS)
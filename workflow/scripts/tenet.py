@@ -4,11 +4,20 @@ import os
 import pandas as pd
 import numpy as np
 import networkx as nx
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import seaborn as sns
 from matplotlib import rcParams
 
+from incremental import load_state, save_state
+from metadata_cache import load_sample_index
+from te_io import read_te
+from te_network import BACKENDS, month_graphs, network_parameters
+from te_plots import FORMATS, draw_month_network, month_layouts, render, save_figure
+from te_windows import window_parameters
+
 sns.set_style('ticks', rc={"axes.facecolor": (0, 0, 0, 0)})
 sns.set_context('talk')
 
@@ -20,48 +29,95 @@ def get_options():
     parser = argparse.ArgumentParser(description=description)
 
     parser.add_argument('snps2te',
-                        help='Output file from snps2te.py containing multiple cols w/ te info')
+                        help='Output file from snps2te.py containing multiple cols w/ te info (TSV or Parquet)')
     parser.add_argument('data',
                         help='Metadata')
-
-    return parser.parse_args()
+    parser.add_argument('--jobs',
+                        default=1,
+                        type=int,
+                        help='Number of processes computing network parameters and rendering plots')
+    parser.add_argument('--backend',
+                        default='networkx',
+                        choices=sorted(BACKENDS),
+                        help='Centrality implementation: networkx, or sparse (scipy.sparse, faster on large components)')
+    parser.add_argument('--approx',
+                        default=None,
+                        type=int,
+                        help='Estimate betweenness, load and current-flow betweenness of components larger than this '
+                             'many nodes (default: exact)')
+    parser.add_argument('--pivots',
+                        default=None,
+                        type=int,
+                        help='Number of sources (betweenness, load) and edges (current-flow) sampled per --approx '
+                             'component (default: the --approx value)')
+    parser.add_argument('--seed',
+                        default=0,
+                        type=int,
+                        help='Random seed for --approx sampling and network layouts')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Reuse the network parameters and layouts of months whose network did not change since '
+                             'the last run')
+    parser.add_argument('--formats',
+                        default=FORMATS,
+                        nargs='+',
+                        choices=['png', 'svg', 'pdf'],
+                        help='Figure formats to save (default: png svg)')
+    parser.add_argument('--window',
+                        default=None,
+                        type=int,
+                        help='Also compute network measures over sliding windows of this many days (default: months only)')
+    parser.add_argument('--step',
+                        default=7,
+                        type=int,
+                        help='Days between the starts of consecutive --window windows')
+
+    options = parser.parse_args()
+    if options.approx is not None and options.approx < 0:
+        parser.error('--approx must be 0 or more nodes')
+    if options.pivots is not None and options.pivots < 1:
+        parser.error('--pivots must be at least 1')
+    if options.window is not None and options.window <= 0:
+        parser.error('--window must be a positive number of days')
+    if options.step <= 0:
+        parser.error('--step must be a positive number of days')
+    return options
 
 
 if __name__ == "__main__":
     options = get_options()
 
     # load data
-    te = pd.read_csv(options.snps2te, sep="\t")
-    d = pd.read_csv(options.data, sep="\t")
+    te = read_te(options.snps2te)
+    d = load_sample_index(options.data)
 
 
     # prepare te
-    # drop duplicates if there are any
-    d.drop_duplicates(subset='sampleid', inplace=True)
+    # metadata is indexed by sampleid, duplicates dropped (first row kept)
     # for klebsiella data, need to fill collection data with MHH and CPH
     d.loc[d['hospital_loc'] == 'Germany', 'collection'] = 'MHH'
     d.loc[d['hospital_loc'] == 'Denmark', 'collection'] = 'CPH'
     # prepare data for network
     # add date
-    te['samplingdate1'] = te['sample1'].map(d.set_index('sampleid')['samplingdate'])
-    te['samplingdate2'] = te['sample2'].map(d.set_index('sampleid')['samplingdate'])
+    te['samplingdate1'] = te['sample1'].map(d['samplingdate'])
+    te['samplingdate2'] = te['sample2'].map(d['samplingdate'])
     # add ST
-    te['ST1'] = te['sample1'].map(d.set_index('sampleid')['ST'])
-    te['ST2'] = te['sample2'].map(d.set_index('sampleid')['ST'])
+    te['ST1'] = te['sample1'].map(d['ST'])
+    te['ST2'] = te['sample2'].map(d['ST'])
     # add hospital_loc and collection
-    te['hospital_loc1'] = te['sample1'].map(d.set_index('sampleid')['hospital_loc'])
-    te['hospital_loc2'] = te['sample2'].map(d.set_index('sampleid')['hospital_loc'])
-    te['collection1'] = te['sample1'].map(d.set_index('sampleid')['collection'])
-    te['collection2'] = te['sample2'].map(d.set_index('sampleid')['collection'])
+    te['hospital_loc1'] = te['sample1'].map(d['hospital_loc'])
+    te['hospital_loc2'] = te['sample2'].map(d['hospital_loc'])
+    te['collection1'] = te['sample1'].map(d['collection'])
+    te['collection2'] = te['sample2'].map(d['collection'])
     # add ressitance score
-    te['resistance1'] = te['sample1'].map(d.set_index('sampleid')['resistance_score'])
-    te['resistance2'] = te['sample2'].map(d.set_index('sampleid')['resistance_score'])
+    te['resistance1'] = te['sample1'].map(d['resistance_score'])
+    te['resistance2'] = te['sample2'].map(d['resistance_score'])
     # add virulence score
-    te['virulence1'] = te['sample1'].map(d.set_index('sampleid')['virulence_score'])
-    te['virulence2'] = te['sample2'].map(d.set_index('sampleid')['virulence_score'])
+    te['virulence1'] = te['sample1'].map(d['virulence_score'])
+    te['virulence2'] = te['sample2'].map(d['virulence_score'])
     # add isolation_source_categ
-    te['isolation_source1'] = te['sample1'].map(d.set_index('sampleid')['isolation_source_categ'])
-    te['isolation_source2'] = te['sample2'].map(d.set_index('sampleid')['isolation_source_categ'])
+    te['isolation_source1'] = te['sample1'].map(d['isolation_source_categ'])
+    te['isolation_source2'] = te['sample2'].map(d['isolation_source_categ'])
     # drop rows with empty samplingdate
     te = te[te['samplingdate1'].notna()]
     te = te[te['samplingdate2'].notna()]
@@ -72,92 +128,39 @@ if __name__ == "__main__":
     # group by monthly counts
     te["samplingdate1"] = pd.to_datetime(te["samplingdate1"])
     te["month"] = te["samplingdate1"].dt.to_period("M")
-    month_groups = te.groupby("month")
 
-    # start empty list
-    network_p = []
+    # build each month's networks once, for both network parameters and plots
+    graphs = month_graphs(te, 'te_10_60d')
 
     # calculate network propertries
-    for month, month_data in month_groups:
-        G = nx.Graph()
-    
-        # add nodes and edges
-        for _, row in month_data.iterrows():
-            G.add_node(row['sample1'], ST=row['ST1'], loc=row["hospital_loc1"], collection=row["collection1"], r=row["resistance1"], v=row["virulence1"], source=row["isolation_source1"])
-            G.add_node(row['sample2'], ST=row['ST2'], loc=row["hospital_loc2"], collection=row["collection2"], r=row["resistance2"], v=row["virulence2"], source=row["isolation_source2"])
-
-            edge_length = row['te_10_60d']
-            G.add_edge(row['sample1'], row['sample2'], weight=edge_length)
-
-        # calculate connected components
-        connected_components = list(nx.connected_components(G))
-    
-        # initialize lists to store centrality measures for connected components
-        degrees_centrality_list = []
-        closeness_centrality_list = []
-        betweenness_centrality_list = []
-        current_flow_betweenness_centrality_list = []
-        load_centrality_list = []
-        harmonic_centrality_list = []
-
-        # iterate over connected components
-        for subgraph_nodes in connected_components:
-            subgraph = G.subgraph(subgraph_nodes)
-        
-            try:
-                # calculate centrality measures for the connected component
-                degrees_centrality = nx.degree_centrality(subgraph)
-                closeness_centrality = nx.closeness_centrality(subgraph)
-                betweenness_centrality = nx.betweenness_centrality(subgraph)
-                current_flow_betweenness_centrality = nx.current_flow_betweenness_centrality(subgraph)
-                load_centrality = nx.load_centrality(subgraph)
-                harmonic_centrality = nx.harmonic_centrality(subgraph)
-
-                # append centrality measures to respective lists
-                degrees_centrality_list.append(degrees_centrality)
-                closeness_centrality_list.append(closeness_centrality)
-                betweenness_centrality_list.append(betweenness_centrality)
-                current_flow_betweenness_centrality_list.append(current_flow_betweenness_centrality)
-                load_centrality_list.append(load_centrality)
-                harmonic_centrality_list.append(harmonic_centrality)
-            except ZeroDivisionError:
-                # handle division by zero error
-                pass
-
-        # calculate average centrality measures across connected components
-        avg_degrees_centrality = sum(map(lambda x: sum(x.values()), degrees_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-        avg_closeness_centrality = sum(map(lambda x: sum(x.values()), closeness_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-        avg_betweenness_centrality = sum(map(lambda x: sum(x.values()), betweenness_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-        avg_current_flow_betweenness_centrality = sum(map(lambda x: sum(x.values()), current_flow_betweenness_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-        avg_load_centrality = sum(map(lambda x: sum(x.values()), load_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-        avg_harmonic_centrality = sum(map(lambda x: sum(x.values()), harmonic_centrality_list)) / len(G.nodes) if len(G.nodes) > 0 else 0
-
-        # Append results to the list
-        network_p.append({
-            'month': month,
-            'degrees_centrality': avg_degrees_centrality,
-            'closeness_centrality': avg_closeness_centrality,
-            'betweenness_centrality': avg_betweenness_centrality,
-            'current_flow_betweenness_centrality': avg_current_flow_betweenness_centrality,
-            'load_centrality': avg_load_centrality,
-            'harmonic_centrality': avg_harmonic_centrality,
-        })
-
-
+    # average centrality measures across connected components, per month
     # create df
-    network_p_te_10_60 = pd.DataFrame(network_p)
+    # with --incremental, months whose network is unchanged are taken from the cache of the last run
+    cache_file = f"{os.path.splitext(options.snps2te)[0]}_network_p.cache.pkl"
+    cache = load_state(cache_file) if options.incremental else None
+    network_p_te_10_60 = network_parameters(graphs, options.jobs, options.backend, options.approx, options.seed,
+                                            cache, options.pivots)
+    if cache is not None:
+        save_state(cache_file, cache)
 
     # save df
     output_file = f"{os.path.splitext(options.snps2te)[0]}_network_p.tsv"
     network_p_te_10_60.to_csv(output_file, index=False, sep='\t')
 
+    # with --window, also over sliding windows, updating the network as events enter and leave each window
+    if options.window:
+        windows_te_10_60 = window_parameters(te, 'te_10_60d', pd.Timedelta(days=options.window),
+                                             pd.Timedelta(days=options.step))
+        output_file = f"{os.path.splitext(options.snps2te)[0]}_network_windows.tsv"
+        windows_te_10_60.to_csv(output_file, index=False, sep='\t')
+
     
     # Draw network
     # plot month counts
     month_counts = te["month"].value_counts().sort_index()
     month_labels = month_counts.index.strftime('%Y-%m')
 
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     plt.bar(month_labels, month_counts.values, color='xkcd:beige')
     plt.xlabel('')
     plt.ylabel('#')
@@ -165,57 +168,18 @@ if __name__ == "__main__":
     plt.xticks(rotation=45, ha="right")
     plt.tight_layout()
     output_file = f"{os.path.splitext(options.snps2te)[0]}_month_counts"
-
-    plt.savefig(f'{output_file}.png',
-            dpi=150,
-            bbox_inches='tight',
-            transparent=True)
-    plt.savefig(f'{output_file}.svg',
-            dpi=150,
-            bbox_inches='tight',
-            transparent=True);
+    save_figure(fig, output_file, options.formats, dpi=150, bbox_inches='tight', transparent=True)
 
     # plot network
-    # define colors
-    collections = {"MHH": "xkcd:lavender", "SRA": "xkcd:turquoise", "CPH": "xkcd:dark blue"}
-
-    # iterate over each month and create a separate plot
-    for month, month_data in month_groups:
-        G = nx.Graph()
-    
-        # add nodes and edges
-        for _, row in month_data.iterrows():
-            G.add_node(row['sample1'], ST=row['ST1'], loc=row["hospital_loc1"], collection=row["collection1"], r=row["resistance1"], v=row["virulence1"], source=row["isolation_source1"])
-            G.add_node(row['sample2'], ST=row['ST2'], loc=row["hospital_loc2"], collection=row["collection2"], r=row["resistance2"], v=row["virulence2"], source=row["isolation_source2"])
-            if row['te_10_60d'] == 1:  
-                edge_length = row['snps']
-                G.add_edge(row['sample1'], row['sample2'], weight=edge_length)
-
-        # draw the graph for the current month
-        plt.figure(figsize=(12, 12))
-        pos = nx.spring_layout(G, scale=5, dim=2, k=0.5)
-
-        # draw edges with adjusted lengths
-        nx.draw_networkx_edges(G, pos, width=[2], edge_vmin=0, edge_vmax=10, edge_color='black', alpha=1)
-
-        # draw color-coded nodes based on collection
-        node_colors = ["xkcd:lavender" if G.nodes[node]["collection"] == "MHH"
-                       else "xkcd:turquoise" if G.nodes[node]["collection"] == "SRA"
-                       else "xkcd:dark blue" for node in G.nodes]
-        nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=150)
-
-        # legend
-        legend_handles = [plt.Line2D([0], [0], marker='o', color='w', markerfacecolor=color, markersize=10, label=label) for label, color in collections.items()]
-        plt.legend(handles=legend_handles, loc='upper left', facecolor="white")
-    
-        plt.title(f'Month: {month}')
-        output_file = f"{os.path.splitext(options.snps2te)[0]}_network_{month}"
-
-        plt.savefig(f'{output_file}.png',
-                dpi=150,
-                bbox_inches='tight',
-                transparent=True)
-        plt.savefig(f'{output_file}.svg',
-                dpi=150,
-                bbox_inches='tight',
-                transparent=True);
+    # layouts of consecutive months are warm-started from each other, unchanged months reuse the cached layout
+    layout_file = f"{os.path.splitext(options.snps2te)[0]}_layout.cache.pkl"
+    layout_cache = load_state(layout_file) if options.incremental else None
+    layouts = month_layouts({month: G for month, (_, G) in graphs.items()}, options.seed, layout_cache)
+    if layout_cache is not None:
+        save_state(layout_file, layout_cache)
+
+    # one figure per month, rendered on a process pool, each figure closed once saved
+    render(draw_month_network,
+           [(month, G, layouts[month], f"{os.path.splitext(options.snps2te)[0]}_network_{month}", options.formats)
+            for month, (_, G) in graphs.items()],
+           options.jobs)